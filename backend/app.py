@@ -4,13 +4,19 @@ COMPLETE WORKING VERSION
 """
 
 from flask import Flask, request, jsonify, send_from_directory
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
-import json
+import orjson
 import os
 from datetime import datetime
 from pathlib import Path
 import sys
 import subprocess
+import threading
+import multiprocessing
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import heapq
 import cv2
 import numpy as np
 import base64 
@@ -24,6 +30,18 @@ sys.path.insert(0, str(CURRENT_FILE.parent))
 print(f"📁 Project Root: {BASE_DIR}")
 print(f"📁 Backend Dir: {CURRENT_FILE.parent}")
 
+# libjpeg-turbo decoder (optional, falls back to cv2.imdecode)
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+    _tj = TurboJPEG()
+except Exception as e:
+    _tj = None
+    print(f"⚠️  TurboJPEG not available, using OpenCV decoder: {e}")
+
+import log_store
+from student_db import StudentDB
+import recognition_worker
+
 # Import face recognition
 try:
     from face_recognition import FaceRecognitionSystem
@@ -31,46 +49,109 @@ except ImportError as e:
     FaceRecognitionSystem = None
     print(f"⚠️  Face recognition not available: {e}")
 
+class OrjsonProvider(JSONProvider):
+    """Serve every jsonify() response through orjson"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # Configuration
-DATABASE_FILE = BASE_DIR / 'students_database.json'
-fr_system = None
+DATABASE_FILE = BASE_DIR / 'students_database.json'  # legacy, imported once
+STUDENTS_DB_FILE = BASE_DIR / 'students.db'
+ACCESS_LOG_FILE = BASE_DIR / 'access_logs.jsonl'
+CAPTURES_FILE = BASE_DIR / 'unpaid_captures.jsonl'
+RECOGNITION_WORKERS = 2
+RECOGNITION_TIMEOUT = 5  # seconds to wait for a worker before giving up
+MAX_RECOGNITION_SIDE = 640  # frames are downscaled to this before recognition
+STATIC_MAX_AGE = 3600  # browser cache lifetime for frontend files (seconds)
+IMMUTABLE_MAX_AGE = 31536000  # scan/capture images never change once written
+MAX_SCANS_LISTED = 20  # newest group scans returned by /api/scans
+
+# Let nginx/Apache send file bodies (X-Sendfile) when deployed behind one
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+recognition_pool = None
+recognition_pool_lock = threading.Lock()  # serializes replacing a broken pool
 scanner_process = None
 
-# Initialize face recognition
+# Initialize face recognition worker pool. Spawned workers re-import this
+# module, so only the main process may start the pool.
 try:
-    if FaceRecognitionSystem:
-        original_dir = os.getcwd()
-        os.chdir(BASE_DIR)
-        fr_system = FaceRecognitionSystem()
-        os.chdir(original_dir)
+    if FaceRecognitionSystem and multiprocessing.current_process().name == 'MainProcess':
+        recognition_pool = recognition_worker.create_pool(BASE_DIR, RECOGNITION_WORKERS)
 except Exception as e:
     print(f"⚠️  Could not initialize face recognition: {e}")
 
+def restart_recognition_pool(broken_pool):
+    """
+    Replace a pool whose worker died (OOM, crash in native inference) -
+    requests get "warming up" until the new workers have loaded the model
+    """
+    global recognition_pool
+    with recognition_pool_lock:
+        # Concurrent requests all see the same broken pool - replace it once
+        if recognition_pool is not broken_pool:
+            return
+        print("⚠️  A recognition worker died, restarting the worker pool")
+        broken_pool.shutdown(wait=False, cancel_futures=True)
+        recognition_pool = recognition_worker.create_pool(BASE_DIR, RECOGNITION_WORKERS)
+
 # Create directories
 (BASE_DIR / 'data' / 'group_scans').mkdir(parents=True, exist_ok=True)
 (BASE_DIR / 'data' / 'registered_faces').mkdir(parents=True, exist_ok=True)
 (BASE_DIR / 'data' / 'unpaid_captures').mkdir(parents=True, exist_ok=True)
 
+# Logs written by older versions lived inside the JSON database
+log_store.migrate_legacy_entries(DATABASE_FILE, 'access_logs', ACCESS_LOG_FILE)
+log_store.migrate_legacy_entries(DATABASE_FILE, 'unpaid_captures', CAPTURES_FILE)
+
 # ==================== DATABASE ====================
 
+student_db = StudentDB(STUDENTS_DB_FILE, legacy_json=DATABASE_FILE)
+
+# Student records cached in memory, re-read only after another process
+# (the student manager, a live scanner) commits a change to students.db
+_db_cache = None
+_db_version = None
+_db_lock = threading.Lock()
+
 def load_database():
-    if DATABASE_FILE.exists():
+    """Load the student records, querying sqlite only when they have changed.
+    
+    The returned dict is shared between requests - treat it as read-only.
+    """
+    global _db_cache, _db_version
+    with _db_lock:
         try:
-            with open(DATABASE_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return {'students': {}, 'access_logs': [], 'unpaid_captures': []}
-    return {'students': {}, 'access_logs': [], 'unpaid_captures': []}
-
-def save_database(db):
-    try:
-        with open(DATABASE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(db, f, indent=2, ensure_ascii=False)
-    except Exception as e:
-        print(f"Error saving database: {e}")
+            version = student_db.data_version()
+            if _db_cache is not None and version == _db_version:
+                return _db_cache
+            _db_cache, _db_version = {'students': student_db.all_students()}, version
+        except Exception as e:
+            print(f"Error loading database: {e}")
+            return {'students': {}}
+        return _db_cache
+
+# Access logs bucketed by date, updated incrementally as the log file grows
+_access_log_index = log_store.DateIndex(ACCESS_LOG_FILE)
+
+def load_today_logs():
+    """Today's access logs, newest first"""
+    today = datetime.now().strftime('%Y-%m-%d')
+    return _access_log_index.entries_for(today)[::-1]
+
+def send_immutable(directory, filename):
+    """Serve a file that is never rewritten, with a long-lived cache header"""
+    response = send_from_directory(directory, filename, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 # ==================== ROUTES ====================
 
@@ -86,7 +167,7 @@ def index():
 def serve_static_files(filename):
     """Serves all other static files (like script.js) from the frontend directory."""
     try:
-        return send_from_directory(BASE_DIR / 'frontend', filename)
+        return send_from_directory(BASE_DIR / 'frontend', filename, max_age=STATIC_MAX_AGE)
     except Exception as e:
         return f"File not found: {filename}", 404
 
@@ -98,8 +179,7 @@ def get_status():
         paid_students = sum(1 for s in db['students'].values() if s.get('fee_status') == 'paid')
         unpaid_students = total_students - paid_students
         
-        today = datetime.now().strftime('%Y-%m-%d')
-        today_logs = [log for log in db['access_logs'] if log.get('timestamp', '').startswith(today)]
+        today_logs = load_today_logs()
         
         total_access = len(today_logs)
         denied_access = sum(1 for log in today_logs if log.get('status', '').startswith('denied') or log.get('status') == 'unrecognized')
@@ -137,9 +217,7 @@ def get_students():
 @app.route('/api/logs')
 def get_logs():
     try:
-        db = load_database()
-        logs = db['access_logs'][-50:]
-        logs.reverse()
+        logs = log_store.read_tail(ACCESS_LOG_FILE, 50)
         return jsonify({'logs': logs})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -147,11 +225,7 @@ def get_logs():
 @app.route('/api/logs/today')
 def get_today_logs():
     try:
-        db = load_database()
-        today = datetime.now().strftime('%Y-%m-%d')
-        today_logs = [log for log in db['access_logs'] if log.get('timestamp', '').startswith(today)]
-        today_logs.reverse()
-        return jsonify({'logs': today_logs})
+        return jsonify({'logs': load_today_logs()})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -159,11 +233,22 @@ def get_today_logs():
 # ==================== WEB RECOGNITION API ====================
 # THIS IS THE NEW ENDPOINT FOR THE WEB-BASED SCANNER
 
+def decode_image(image_bytes):
+    """Decode JPEG bytes to a BGR frame (libjpeg-turbo first, OpenCV fallback)"""
+    if _tj is not None:
+        try:
+            return _tj.decode(image_bytes, pixel_format=TJPF_BGR)
+        except Exception:
+            pass  # Not a JPEG (or corrupt header) - let OpenCV handle it
+    
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
 @app.route('/api/recognize', methods=['POST'])
 def web_recognize():
     
     # 1. Check if Face Recognition system is loaded
-    if not fr_system:
+    if not recognition_pool:
         return jsonify({
             'status': 'ERROR',
             'message': 'Face Recognition system is not initialized on the server.'
@@ -179,31 +264,45 @@ def web_recognize():
         image_data = data['image_base64'].split(',')[1] # Remove "data:image/jpeg;base64,"
         image_bytes = base64.b64decode(image_data)
         
-        # Convert bytes to a numpy array for OpenCV
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        frame = decode_image(image_bytes)
+        
+        # Recognition time grows with pixel count - work on a <=640px frame
+        scale = MAX_RECOGNITION_SIDE / max(frame.shape[:2])
+        if scale < 1:
+            frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        else:
+            scale = 1.0
 
     except Exception as e:
         print(f"Error decoding image: {e}")
         return jsonify({'status': 'ERROR', 'message': f'Error decoding image: {e}'}), 400
     
-    # 3. Save to a temporary file for fr_system to read
-    # (fr_system.recognize_face expects a file path)
-    temp_image_path = BASE_DIR / 'data' / 'temp_web_capture.jpg'
-    try:
-        cv2.imwrite(str(temp_image_path), frame)
-    except Exception as e:
-        return jsonify({'status': 'ERROR', 'message': f'Could not save temp file: {e}'}), 500
-
-    # 4. === RUN RECOGNITION ===
+    # 3. === RUN RECOGNITION ===
+    # Freshly spawned workers spend a while loading the model - don't queue
+    # scans behind that only to time them out
+    if not recognition_worker.is_ready():
+        return jsonify({'status': 'ERROR', 'message': 'Face recognition is warming up, try again shortly.'}), 503
+    
+    pool = recognition_pool
     try:
-        # Use the same FaceRecognitionSystem loaded at startup
-        result = fr_system.recognize_face(str(temp_image_path))
+        # Hand the frame to a worker process that already has the model loaded
+        future = pool.submit(recognition_worker.recognize, frame)
+        result = future.result(timeout=RECOGNITION_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        future.cancel()  # Still queued - drop it rather than run it for nobody
+        return jsonify({'status': 'ERROR', 'message': 'Recognition timed out, server is busy.'}), 503
+    except BrokenProcessPool:
+        restart_recognition_pool(pool)
+        return jsonify({'status': 'ERROR', 'message': 'Face recognition is restarting, try again shortly.'}), 503
     except Exception as e:
         print(f"Recognition error: {e}")
         return jsonify({'status': 'ERROR', 'message': f'Recognition error: {e}'}), 500
+    
+    # Map face box back to the resolution the client sent
+    if scale != 1.0 and result.get('face_coords'):
+        result['face_coords'] = [int(round(c / scale)) for c in result['face_coords']]
 
-    # 5. === CHECK DATABASE FOR FEE STATUS ===
+    # 4. === CHECK DATABASE FOR FEE STATUS ===
     try:
         db = load_database()
         students = db.get('students', {})
@@ -264,11 +363,6 @@ def web_recognize():
         print(f"Error checking database: {e}")
         return jsonify({'status': 'ERROR', 'message': f'Database processing error: {e}'}), 500
 
-    finally:
-        # 6. Clean up the temporary file
-        if temp_image_path.exists():
-            os.remove(temp_image_path)
-
 
 # ==================== SCANNER CONTROL ====================
 
@@ -318,47 +412,68 @@ def scanner_status():
         'pid': scanner_process.pid if is_running else None
     })
 
-@app.route('/api/scans')
-def get_scans():
-    try:
-        scans_dir = BASE_DIR / 'data' / 'group_scans'
-        if not scans_dir.exists():
-            return jsonify({'scans': []})
+# Newest scans cached in memory, invalidated when the directory's mtime changes
+_scans_cache = None
+_scans_mtime = 0
+_scans_lock = threading.Lock()
+
+def list_recent_scans(scans_dir):
+    """Newest group scans (with their text reports), newest first"""
+    global _scans_cache, _scans_mtime
+    mtime = scans_dir.stat().st_mtime_ns
+    with _scans_lock:
+        if _scans_cache is not None and mtime == _scans_mtime:
+            return _scans_cache
+        
+        # scandir hands back each entry's stat, so every file is stat'ed once
+        with os.scandir(scans_dir) as it:
+            entries = [(entry, entry.stat()) for entry in it
+                       if entry.name.endswith('.jpg') and entry.is_file()]
+        # Name (it embeds the scan timestamp) breaks ties, e.g. after a fresh checkout
+        newest = heapq.nlargest(MAX_SCANS_LISTED, entries,
+                                key=lambda item: (item[1].st_mtime, item[0].name))
         
         scans = []
-        for img_file in sorted(scans_dir.glob('*.jpg'), reverse=True):
-            txt_file = img_file.with_suffix('.txt')
-            
+        for entry, stat in newest:
             scan_info = {
-                'image': img_file.name,
-                'timestamp': datetime.fromtimestamp(img_file.stat().st_mtime).isoformat(),
-                'size': img_file.stat().st_size
+                'image': entry.name,
+                'timestamp': datetime.fromtimestamp(stat.st_mtime).isoformat(),
+                'size': stat.st_size
             }
             
-            if txt_file.exists():
-                try:
-                    with open(txt_file, 'r', encoding='utf-8') as f:
-                        scan_info['report'] = f.read()
-                except:
-                    pass
+            try:
+                with open(entry.path[:-4] + '.txt', 'r', encoding='utf-8') as f:
+                    scan_info['report'] = f.read()
+            except (OSError, UnicodeDecodeError):
+                pass
             
             scans.append(scan_info)
         
-        return jsonify({'scans': scans[:20]})
+        _scans_cache, _scans_mtime = scans, mtime
+        return scans
+
+@app.route('/api/scans')
+def get_scans():
+    try:
+        scans_dir = BASE_DIR / 'data' / 'group_scans'
+        if not scans_dir.exists():
+            return jsonify({'scans': []})
+        
+        return jsonify({'scans': list_recent_scans(scans_dir)})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/scans/<filename>')
 def get_scan_image(filename):
     try:
-        return send_from_directory(BASE_DIR / 'data' / 'group_scans', filename)
+        return send_immutable(BASE_DIR / 'data' / 'group_scans', filename)
     except Exception as e:
         return jsonify({'error': str(e)}), 404
 
 @app.route('/api/images/<path:filename>')
 def serve_image(filename):
     try:
-        return send_from_directory(BASE_DIR / 'data' / 'unpaid_captures', filename)
+        return send_immutable(BASE_DIR / 'data' / 'unpaid_captures', filename)
     except Exception as e:
         return jsonify({'error': str(e)}), 404
 
@@ -369,7 +484,8 @@ def health():
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'face_recognition': fr_system is not None
+        'face_recognition': recognition_pool is not None,
+        'face_recognition_ready': recognition_pool is not None and recognition_worker.is_ready()
     })
 
 if __name__ == '__main__':
@@ -379,9 +495,17 @@ if __name__ == '__main__':
     print(f"\n📡 Server starting from: {CURRENT_FILE.parent}")
     print(f"📁 Project root: {BASE_DIR}")
     print(f"📁 Database: {DATABASE_FILE}")
-    print(f"🤖 Face Recognition: {'✅ Available' if fr_system else '❌ Not Available'}")
+    print(f"🤖 Face Recognition: {'✅ Available' if recognition_pool else '❌ Not Available'} ({RECOGNITION_WORKERS} workers)")
     print("\n🌐 Access dashboard at: http://localhost:5000")
     print("📱 For remote access: Use your local IP address")
     print("\n" + "=" * 60 + "\n")
     
-    app.run()
\ No newline at end of file
+    # Production WSGI server with a thread pool; Flask's dev server handles
+    # one request at a time and drops connections under dashboard polling
+    try:
+        from waitress import serve
+    except ImportError:
+        print("⚠️  waitress not installed, falling back to Flask dev server")
+        app.run(host='0.0.0.0', port=5000, threaded=True)
+    else:
+        serve(app, host='0.0.0.0', port=5000, threads=8)
\ No newline at end of file
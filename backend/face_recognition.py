@@ -4,17 +4,325 @@ Handles all face detection and recognition operations
 """
 
 import cv2
+import hashlib
+import io
 import os
+import tempfile
+import time
+import uuid
 import numpy as np
 from deepface import DeepFace
 import pickle
+from contextlib import contextmanager
 from pathlib import Path
-import json
+import orjson
 from datetime import datetime
+import log_store
+
+# ONNX Runtime is optional - without it embeddings come from DeepFace/TensorFlow
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+# InsightFace is optional - one ONNX pass gives boxes and aligned ArcFace embeddings
+try:
+    from insightface.app import FaceAnalysis
+except ImportError:
+    FaceAnalysis = None
+
+# FAISS is optional - without it matching is a NumPy matrix-vector product
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# Relative paths are resolved against the project root, not the CWD
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+# Nearest registered faces looked up per query (unless all matches are requested)
+MAX_MATCHES = 5
+
+# The embeddings file is compacted once it holds more deleted/replaced rows
+# than this (and more than live ones) - until then changes are appended
+COMPACT_MIN_DEAD_ROWS = 32
+
+# Haar detection runs on a frame downscaled by this factor; boxes are scaled back
+DET_SCALE = 0.5
+
+# A registered image whose largest detected face covers at least this
+# fraction of it is a crop saved by register_face, not a whole photo -
+# re-detecting inside it would only shave the edges off the enrolled crop
+TIGHT_CROP_MIN_FILL = 0.5
+
+# Version of how registered images are turned into embeddings (see
+# embed_registered_image), part of every cache tag - bump it when that
+# changes so caches from the old pipeline are rebuilt instead of mixed in
+EMBEDDING_PIPELINE = 'crop-v2'
+
+# A lock file older than this was left behind by a killed process (an
+# ONNX export or quantization takes a minute or two, not ten)
+STALE_LOCK_SECONDS = 600
+
+# Haar cascade shared by every FaceRecognitionSystem in the process
+_CASCADE = None
+
+
+def _get_cascade():
+    """Load the Haar cascade XML on first use and reuse it afterwards"""
+    global _CASCADE
+    if _CASCADE is None:
+        _CASCADE = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    return _CASCADE
+
+
+def l2_normalize(embedding):
+    """Scale an embedding to unit length, so cosine similarity is a plain dot product"""
+    embedding = np.asarray(embedding, dtype=np.float32).ravel()
+    return embedding / np.linalg.norm(embedding)
+
+
+@contextmanager
+def file_lock(path, poll_interval=0.2):
+    """
+    Hold a cross-process lock on `path` - the pool workers, the scanner and
+    the student manager can all start at once and write the same files
+    
+    The lock is an exclusively-created <path>.lock file, so it behaves the
+    same on Windows and Linux.
+    """
+    lock_path = f"{path}.lock"
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > STALE_LOCK_SECONDS:
+                    os.remove(lock_path)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(poll_interval)
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        yield
+    finally:
+        os.close(fd)
+        try:
+            os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+
+
+def temp_path_for(path):
+    """
+    A new, uniquely named file beside `path` to write into before
+    os.replace() - same directory, so the replace is atomic
+    """
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{path.stem}.", suffix=path.suffix, dir=path.parent)
+    os.close(fd)
+    return tmp_path
+
+
+def append_npy_rows(path, rows, expected_rows):
+    """
+    Append rows to a 2-D float32 .npy file in place - the new rows are
+    written at the end and the header's shape is patched, nothing else is read
+    
+    Args:
+        path: .npy file holding an (expected_rows, D) float32 array
+        rows: (K, D) float32 array to append
+        expected_rows: Row count the file must currently have
+        
+    Returns:
+        bool: False if the file doesn't match (the caller should rewrite it)
+    """
+    read_header = {(1, 0): np.lib.format.read_array_header_1_0,
+                   (2, 0): np.lib.format.read_array_header_2_0}
+    write_header = {(1, 0): np.lib.format.write_array_header_1_0,
+                    (2, 0): np.lib.format.write_array_header_2_0}
+    rows = np.ascontiguousarray(rows, dtype=np.float32)
+    
+    try:
+        f = open(path, 'r+b')
+    except FileNotFoundError:
+        return False
+    with f:
+        version = np.lib.format.read_magic(f)
+        if version not in read_header:
+            return False
+        shape, fortran_order, dtype = read_header[version](f)
+        data_offset = f.tell()
+        if (fortran_order or dtype != np.float32 or len(shape) != 2 or
+                shape != (expected_rows, rows.shape[1])):
+            return False
+        
+        # The header is padded to a fixed size, so a longer shape still fits
+        header = io.BytesIO()
+        write_header[version](header, {
+            'descr': np.lib.format.dtype_to_descr(dtype),
+            'fortran_order': False,
+            'shape': (expected_rows + len(rows), rows.shape[1]),
+        })
+        if header.tell() != data_offset:
+            return False
+        
+        # Data first, then the header - an interrupted append leaves a
+        # valid file with the old shape
+        f.seek(data_offset + expected_rows * rows.shape[1] * dtype.itemsize)
+        f.write(rows.tobytes())
+        f.flush()
+        f.seek(0)
+        f.write(header.getvalue())
+    return True
+
+
+def onnx_providers(cache_dir):
+    """
+    ONNX Runtime execution providers usable on this machine, fastest first
+    
+    Args:
+        cache_dir: Where TensorRT keeps its built engines between runs
+    """
+    available = ort.get_available_providers()
+    providers = []
+    if 'TensorrtExecutionProvider' in available:
+        providers.append(('TensorrtExecutionProvider', {
+            'trt_fp16_enable': True,
+            'trt_engine_cache_enable': True,
+            'trt_engine_cache_path': str(cache_dir),
+        }))
+    if 'CUDAExecutionProvider' in available:
+        providers.append('CUDAExecutionProvider')
+    providers.append('CPUExecutionProvider')
+    return providers
+
+class SCRFDDetector:
+    """
+    Lightweight ONNX face detector (InsightFace SCRFD, e.g. scrfd_500m)
+    
+    Anchor centres depend only on the input size and stride, so they are
+    built once and cached; NMS IoU is computed with NumPy broadcasting.
+    """
+    
+    def __init__(self, model_path, input_size=(640, 480),
+                 score_threshold=0.5, nms_threshold=0.4, num_threads=None):
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(str(model_path), sess_options=options,
+                                            providers=onnx_providers(Path(model_path).parent))
+        input_meta = self.session.get_inputs()[0]
+        self.input_name = input_meta.name
+        self.output_names = [o.name for o in self.session.get_outputs()]
+        
+        # Models exported with a fixed input size must be fed exactly that
+        if isinstance(input_meta.shape[2], int) and isinstance(input_meta.shape[3], int):
+            input_size = (input_meta.shape[3], input_meta.shape[2])
+        self.input_size = input_size  # (width, height)
+        self.score_threshold = score_threshold
+        self.nms_threshold = nms_threshold
+        
+        # 6/9 outputs: 3 strides x (scores, boxes[, keypoints]) with 2 anchors;
+        # 10/15 outputs: 5 strides with 1 anchor
+        self.fmc = 3 if len(self.output_names) in (6, 9) else 5
+        self.strides = [8, 16, 32] if self.fmc == 3 else [8, 16, 32, 64, 128]
+        self.num_anchors = 2 if self.fmc == 3 else 1
+        self.batched = len(self.session.get_outputs()[0].shape) == 3
+        
+        self._anchor_cache = {}
+    
+    def anchor_centers(self, height, width, stride):
+        """(x, y) centre of every anchor on a stride's feature map, cached"""
+        key = (height, width, stride)
+        centers = self._anchor_cache.get(key)
+        if centers is None:
+            centers = np.stack(np.mgrid[:height, :width][::-1], axis=-1).astype(np.float32)
+            centers = (centers * stride).reshape(-1, 2)
+            if self.num_anchors > 1:
+                centers = np.repeat(centers, self.num_anchors, axis=0)
+            self._anchor_cache[key] = centers
+        return centers
+    
+    def detect(self, image):
+        """
+        Detect faces in a BGR image
+        
+        Returns:
+            Array of face rectangles [(x, y, w, h), ...], best score first
+        """
+        in_w, in_h = self.input_size
+        img_h, img_w = image.shape[:2]
+        
+        # Fit the frame into the fixed input, padding bottom/right
+        scale = min(in_w / img_w, in_h / img_h)
+        resized = cv2.resize(image, (int(img_w * scale), int(img_h * scale)))
+        canvas = np.zeros((in_h, in_w, 3), dtype=np.uint8)
+        canvas[:resized.shape[0], :resized.shape[1]] = resized
+        
+        blob = cv2.dnn.blobFromImage(canvas, 1.0 / 128, (in_w, in_h),
+                                     (127.5, 127.5, 127.5), swapRB=True)
+        outputs = self.session.run(self.output_names, {self.input_name: blob})
+        
+        all_scores, all_boxes = [], []
+        for idx, stride in enumerate(self.strides):
+            scores = outputs[idx]
+            distances = outputs[idx + self.fmc]
+            if self.batched:
+                scores, distances = scores[0], distances[0]
+            
+            scores = scores.reshape(-1)
+            keep = scores >= self.score_threshold
+            if not keep.any():
+                continue
+            
+            centers = self.anchor_centers(in_h // stride, in_w // stride, stride)[keep]
+            distances = distances.reshape(-1, 4)[keep] * stride
+            all_boxes.append(np.hstack([centers - distances[:, :2], centers + distances[:, 2:]]))
+            all_scores.append(scores[keep])
+        
+        if not all_scores:
+            return np.empty((0, 4), dtype=int)
+        
+        scores = np.concatenate(all_scores)
+        boxes = np.concatenate(all_boxes) / scale
+        boxes = boxes[self.nms(boxes, scores)]
+        
+        x1 = np.clip(boxes[:, 0], 0, img_w)
+        y1 = np.clip(boxes[:, 1], 0, img_h)
+        x2 = np.clip(boxes[:, 2], 0, img_w)
+        y2 = np.clip(boxes[:, 3], 0, img_h)
+        return np.stack([x1, y1, x2 - x1, y2 - y1], axis=1).astype(int)
+    
+    def nms(self, boxes, scores):
+        """Greedy non-maximum suppression; returns kept indices, best first"""
+        order = scores.argsort()[::-1]
+        x1, y1, x2, y2 = boxes[order].T
+        areas = (x2 - x1) * (y2 - y1)
+        
+        # Pairwise IoU of all candidates in one shot
+        inter_w = np.clip(np.minimum(x2[:, None], x2[None, :]) - np.maximum(x1[:, None], x1[None, :]), 0, None)
+        inter_h = np.clip(np.minimum(y2[:, None], y2[None, :]) - np.maximum(y1[:, None], y1[None, :]), 0, None)
+        inter = inter_w * inter_h
+        iou = inter / (areas[:, None] + areas[None, :] - inter + 1e-9)
+        
+        suppressed = np.zeros(len(order), dtype=bool)
+        keep = []
+        for i in range(len(order)):
+            if suppressed[i]:
+                continue
+            keep.append(i)
+            suppressed |= iou[i] > self.nms_threshold
+        return order[keep]
+
 
 class FaceRecognitionSystem:
     def __init__(self, registered_faces_dir='data/registered_faces', 
-                 model_name='Facenet512', threshold=0.6):
+                 model_name='Facenet512', threshold=0.6, onnx_dir='models',
+                 quantize=True, detector_model='scrfd_500m.onnx', base_dir=None,
+                 quantize_index=True, analyzer='buffalo_s', onnx_threads=None):
         """
         Initialize Face Recognition System
         
@@ -22,65 +330,437 @@ class FaceRecognitionSystem:
             registered_faces_dir: Directory containing registered face images
             model_name: DeepFace model ('VGG-Face', 'Facenet', 'Facenet512', 'OpenFace', 'DeepFace', 'DeepID', 'ArcFace', 'Dlib')
             threshold: Similarity threshold (lower = stricter matching)
+            onnx_dir: Where the exported ONNX copy of the model is kept
+            quantize: Use an INT8-quantized copy of the ONNX model when it
+                      matches the FP32 model closely enough
+            detector_model: SCRFD ONNX file in onnx_dir used for detection
+                            when present (Haar cascade otherwise)
+            base_dir: Directory the relative paths above are resolved against
+                      (defaults to the project root)
+            quantize_index: Store registered embeddings as 8-bit codes in the
+                            FAISS index (ignored without FAISS)
+            analyzer: InsightFace model pack used for both detection and
+                      embeddings when insightface is installed (None = off)
+            onnx_threads: CPU threads per ONNX Runtime session (None = ONNX
+                          Runtime's default of one per core) - lower it when
+                          several processes share the machine
         """
-        self.registered_faces_dir = Path(registered_faces_dir)
+        self.base_dir = Path(base_dir) if base_dir else PROJECT_ROOT
+        onnx_dir = self.base_dir / onnx_dir
+        
+        self.registered_faces_dir = self.base_dir / registered_faces_dir
         self.registered_faces_dir.mkdir(parents=True, exist_ok=True)
         
         self.model_name = model_name
         self.threshold = threshold
+        self.onnx_threads = onnx_threads
+        
+        # InsightFace detector + embedder; replaces everything below when loaded
+        self.face_app = self.load_face_analyzer(analyzer)
+        
+        # ONNX Runtime session for the embedding model (None = use DeepFace)
+        self.onnx_model_path = onnx_dir / f"{model_name}.onnx"
+        self.onnx_int8_path = onnx_dir / f"{model_name}_int8.onnx"
+        self.quantize = quantize
+        self.onnx_precision = None  # 'fp32', 'fp16' (TensorRT) or 'int8' once loaded
+        self.onnx_session = None if self.face_app else self.load_onnx_session()
         
-        # Cache for face embeddings (for faster recognition)
-        self.embeddings_cache_file = 'data/face_embeddings_cache.pkl'
+        # Cached embeddings are only comparable when made by the same model,
+        # backend, precision and enrolment pipeline - a change here
+        # triggers a cache rebuild
+        if self.face_app:
+            self.embedding_model = f"insightface/{analyzer}/{EMBEDDING_PIPELINE}"
+        elif self.onnx_session is not None:
+            self.embedding_model = f"{model_name}/onnx-{self.onnx_precision}/{EMBEDDING_PIPELINE}"
+        else:
+            self.embedding_model = f"{model_name}/{EMBEDDING_PIPELINE}"
+        
+        # Cache for face embeddings (for faster recognition): the matrix is
+        # kept as .npy (memory-mapped on load), student details as JSONL -
+        # one line per .npy row, plus {"deleted": row} tombstones and a
+        # {"generation": token} line closing each commit
+        self.embeddings_file = str(self.base_dir / 'data' / 'face_embeddings.npy')
+        self.embeddings_meta_file = str(self.base_dir / 'data' / 'face_embeddings_meta.jsonl')
+        self.legacy_meta_file = str(self.base_dir / 'data' / 'face_embeddings_meta.json')
+        self.legacy_cache_file = str(self.base_dir / 'data' / 'face_embeddings_cache.pkl')
         self.embeddings_cache = {}
+        self._dirty = False  # changed since the last commit()
         
-        # Face detection cascade (for quick face detection)
-        self.face_cascade = cv2.CascadeClassifier(
-            cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-        )
+        # What is on disk, so commit() can append instead of rewriting
+        self._disk_rows = 0     # rows in the .npy, dead ones included
+        self._disk_row = {}     # student_id -> its live row in the .npy
+        self._tombstones = []   # rows to mark deleted at the next commit()
+        self._forgotten = set() # student_ids removed/replaced since the last commit()
+        self._rewrite = False   # next commit() must rewrite both files
+        # Token written at the end of every commit - a different one on disk
+        # means another process changed the files after this one read them
+        self._disk_generation = None
+        
+        # Cache stacked into one L2-normalized matrix (plus a FAISS index
+        # over it when available), so matching is a single inner product
+        self.id_list = []
+        self.emb_matrix = np.empty((0, 0), dtype=np.float32)
+        self.index = None
+        self.quantize_index = quantize_index
+        
+        # Face detection cascade (for quick face detection), parsed once per process
+        self.face_cascade = _get_cascade()
+        # Run it through OpenCV's OpenCL kernels (T-API) when a device exists
+        self.use_umat = cv2.ocl.haveOpenCL()
+        if self.use_umat:
+            cv2.ocl.setUseOpenCL(True)
+        
+        # Faster and more accurate ONNX detector, if its model is available
+        self.face_detector = self.load_face_detector(onnx_dir / detector_model)
         
         print(f"🚀 Face Recognition System initialized")
-        print(f"   Model: {model_name}")
+        print(f"   Model: {self.embedding_model}")
         print(f"   Threshold: {threshold}")
         print(f"   Registered faces directory: {self.registered_faces_dir}")
         
         # Load existing embeddings cache
         self.load_embeddings_cache()
     
-    def detect_faces(self, image):
+    def load_face_analyzer(self, name):
+        """Load the InsightFace model pack, or None to use the models below"""
+        if FaceAnalysis is None or not name:
+            return None
+        try:
+            face_app = FaceAnalysis(name=name, allowed_modules=['detection', 'recognition'],
+                                    providers=onnx_providers(self.base_dir / 'models'))
+            face_app.prepare(ctx_id=0, det_size=(640, 640))
+            print(f"⚡ InsightFace analyzer: {name}")
+            return face_app
+        except Exception as e:
+            print(f"⚠️  Could not load InsightFace {name}: {e}")
+            return None
+    
+    def analyze(self, image):
         """
-        Quick face detection using Haar Cascade
+        Detect and embed every face in one InsightFace pass
         
         Args:
             image: Image array (BGR format)
             
+        Returns:
+            List of ((x, y, w, h), normalized embedding), most confident first
+        """
+        height, width = image.shape[:2]
+        results = []
+        for face in sorted(self.face_app.get(image), key=lambda f: f.det_score, reverse=True):
+            x1, y1, x2, y2 = face.bbox
+            x1, y1 = max(int(x1), 0), max(int(y1), 0)
+            x2, y2 = min(int(x2), width), min(int(y2), height)
+            results.append(((x1, y1, x2 - x1, y2 - y1), face.normed_embedding))
+        return results
+    
+    def insightface_embedding(self, face_image):
+        """Embed an already-cropped face with InsightFace"""
+        # Detection (and so alignment) needs some context around a tight crop
+        h, w = face_image.shape[:2]
+        pad_y, pad_x = h // 4, w // 4
+        padded = cv2.copyMakeBorder(face_image, pad_y, pad_y, pad_x, pad_x,
+                                    cv2.BORDER_CONSTANT, value=0)
+        faces = self.analyze(padded)
+        if faces:
+            return faces[0][1]
+        
+        # Still not detected - embed the crop without alignment
+        return l2_normalize(self.face_app.models['recognition'].get_feat(face_image)[0])
+    
+    def load_face_detector(self, model_path):
+        """Load the SCRFD detector, or None to use the Haar cascade"""
+        if ort is None or not model_path.exists():
+            return None
+        try:
+            detector = SCRFDDetector(model_path, num_threads=self.onnx_threads)
+            print(f"⚡ SCRFD face detector: {model_path}")
+            return detector
+        except Exception as e:
+            print(f"⚠️  Could not load {model_path}, using Haar cascade: {e}")
+            return None
+    
+    def detect_faces(self, image, scale=DET_SCALE, gray=None):
+        """
+        Quick face detection using SCRFD (if available) or Haar Cascade
+        
+        Args:
+            image: Image array (BGR format)
+            scale: Downscale factor applied before Haar detection
+            gray: Optional grayscale copy of image the caller already has -
+                  the Haar path uses it instead of converting again
+            
         Returns:
             List of face rectangles [(x, y, w, h), ...]
         """
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if self.face_app is not None:
+            boxes, _ = self.face_app.det_model.detect(image)
+            boxes = boxes[np.argsort(-boxes[:, 4])]
+            top_left = np.maximum(boxes[:, :2], 0)
+            return np.column_stack([top_left, boxes[:, 2:4] - top_left]).astype(int)
+        
+        if self.face_detector is not None:
+            return self.face_detector.detect(image)
+        
+        if gray is None:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return self.detect_faces_gray(gray, scale)
+    
+    def detect_faces_gray(self, gray, scale=DET_SCALE):
+        """
+        Haar Cascade face detection on an already-grayscale image
+        
+        Args:
+            gray: Grayscale image array
+            scale: Downscale factor applied before detection
+            
+        Returns:
+            List of face rectangles [(x, y, w, h), ...]
+        """
+        if self.use_umat:
+            gray = cv2.UMat(gray)  # resize/detection run on the GPU
+        
+        # Haar cost grows with pixel count - detect on a smaller copy
+        if scale != 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        min_side = max(24, int(30 * scale))  # 24px is the cascade's native window
+        
         faces = self.face_cascade.detectMultiScale(
             gray, 
             scaleFactor=1.1, 
             minNeighbors=5, 
-            minSize=(30, 30)
+            minSize=(min_side, min_side)
         )
+        if scale != 1.0 and len(faces):
+            faces = (faces / scale).astype(int)
         return faces
     
-    def extract_face_embedding(self, image_path):
+    def load_onnx_session(self):
+        """
+        Load the embedding model into ONNX Runtime, exporting it from
+        DeepFace's Keras model on first run
+        
+        Returns:
+            InferenceSession, or None to fall back to DeepFace
+        """
+        if ort is None:
+            return None
+        
+        try:
+            if not self.onnx_model_path.exists():
+                # Only one process exports; the others wait and then load its file
+                self.onnx_model_path.parent.mkdir(parents=True, exist_ok=True)
+                with file_lock(self.onnx_model_path):
+                    if not self.onnx_model_path.exists():
+                        self.export_onnx_model()
+            
+            session = self.open_onnx_session(self.onnx_model_path)
+            
+            # Keras exports are NHWC; accept NCHW models too
+            input_meta = session.get_inputs()[0]
+            self.onnx_input_name = input_meta.name
+            self.onnx_nhwc = input_meta.shape[-1] == 3
+            self.onnx_input_size = tuple(input_meta.shape[1:3] if self.onnx_nhwc else input_meta.shape[2:4])
+            
+            # Dynamic INT8 ops only have CPU kernels - keep FP32 on a GPU
+            provider = session.get_providers()[0]
+            self.onnx_precision = 'fp16' if provider == 'TensorrtExecutionProvider' else 'fp32'
+            if self.quantize and provider == 'CPUExecutionProvider':
+                int8_session = self.load_int8_session(session)
+                if int8_session is not None:
+                    session = int8_session
+                    self.onnx_precision = 'int8'
+            
+            print(f"⚡ ONNX Runtime backend: {self.onnx_model_path} ({session.get_providers()[0]})")
+            return session
+        except Exception as e:
+            print(f"⚠️  ONNX Runtime unavailable, using DeepFace: {e}")
+            return None
+    
+    def open_onnx_session(self, model_path):
+        """Create an InferenceSession on the fastest available device, limited to onnx_threads CPU threads"""
+        options = ort.SessionOptions()
+        if self.onnx_threads:
+            options.intra_op_num_threads = self.onnx_threads
+        return ort.InferenceSession(
+            str(model_path),
+            sess_options=options,
+            providers=onnx_providers(self.onnx_model_path.parent)
+        )
+    
+    def load_int8_session(self, fp32_session, min_similarity=0.99):
+        """
+        Load (quantizing on first run) the INT8 copy of the model
+        
+        A freshly quantized model is only kept if its embeddings of the
+        registered faces stay within 1% cosine similarity of the FP32 model.
+        A rejected model is kept as *.rejected so it is not re-tried on
+        every startup.
+        
+        Returns:
+            InferenceSession, or None to keep using FP32
+        """
+        rejected_path = self.onnx_int8_path.with_suffix('.rejected')
+        if not self.onnx_int8_path.exists() and not rejected_path.exists():
+            try:
+                # Only one process quantizes; the others wait and then load its file
+                with file_lock(self.onnx_int8_path):
+                    if not self.onnx_int8_path.exists() and not rejected_path.exists():
+                        self.quantize_model(fp32_session, rejected_path, min_similarity)
+            except Exception as e:
+                print(f"⚠️  INT8 quantization failed, keeping FP32: {e}")
+                return None
+        
+        if not self.onnx_int8_path.exists():
+            return None
+        try:
+            return self.open_onnx_session(self.onnx_int8_path)
+        except Exception as e:
+            # Unreadable (e.g. cut short by an older version) - quantize afresh next start
+            print(f"⚠️  Could not load {self.onnx_int8_path}, keeping FP32: {e}")
+            try:
+                os.remove(self.onnx_int8_path)
+            except OSError:
+                pass
+            return None
+    
+    def quantize_model(self, fp32_session, rejected_path, min_similarity):
+        """
+        Quantize the FP32 model to INT8 and validate it against the
+        registered faces - the result only reaches onnx_int8_path (or
+        rejected_path) once complete, so a killed run leaves nothing behind
+        """
+        samples = [cv2.imread(str(p)) for p in self.registered_faces_dir.glob('*.jpg')]
+        samples = [img for img in samples if img is not None]
+        if not samples:
+            # Nothing to validate against yet - try again once faces are registered
+            return
+        
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        print("🔄 Quantizing embedding model to INT8...")
+        tmp_path = temp_path_for(self.onnx_int8_path)
+        try:
+            quantize_dynamic(str(self.onnx_model_path), tmp_path, weight_type=QuantType.QInt8)
+            int8_session = self.open_onnx_session(tmp_path)
+            
+            worst = 1.0
+            for img in samples:
+                a = self.onnx_embedding(img, fp32_session)
+                b = self.onnx_embedding(img, int8_session)
+                worst = min(worst, float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))))
+            del int8_session
+            
+            if worst < min_similarity:
+                print(f"⚠️  INT8 model rejected (cosine {worst:.4f} < {min_similarity}), keeping FP32")
+                os.replace(tmp_path, rejected_path)
+                return
+            
+            os.replace(tmp_path, self.onnx_int8_path)
+            print(f"✅ INT8 model accepted (worst cosine vs FP32: {worst:.4f})")
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    
+    def export_onnx_model(self):
+        """One-time export of the DeepFace Keras model to ONNX (needs tf2onnx)"""
+        import tensorflow as tf
+        import tf2onnx
+        
+        print(f"🔄 Exporting {self.model_name} to ONNX...")
+        client = DeepFace.build_model(self.model_name)
+        width, height = client.input_shape
+        spec = (tf.TensorSpec((None, height, width, 3), tf.float32, name='input'),)
+        
+        # Export under a temporary name so a half-written model is never loaded
+        tmp_path = temp_path_for(self.onnx_model_path)
+        try:
+            tf2onnx.convert.from_keras(client.model, input_signature=spec, output_path=tmp_path)
+            os.replace(tmp_path, self.onnx_model_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        print(f"✅ Exported model to {self.onnx_model_path}")
+    
+    def letterbox(self, face_image, target_size):
+        """
+        Resize a face to the model input (height, width), keeping its
+        aspect ratio and padding the rest with black - as DeepFace does
+        """
+        target_h, target_w = target_size
+        h, w = face_image.shape[:2]
+        factor = min(target_h / h, target_w / w)
+        # INTER_AREA averages source pixels when shrinking instead of skipping them
+        interpolation = cv2.INTER_AREA if factor < 1 else cv2.INTER_LINEAR
+        resized = cv2.resize(face_image, (int(w * factor), int(h * factor)),
+                             interpolation=interpolation)
+        
+        pad_h = target_h - resized.shape[0]
+        pad_w = target_w - resized.shape[1]
+        return cv2.copyMakeBorder(resized, pad_h // 2, pad_h - pad_h // 2,
+                                  pad_w // 2, pad_w - pad_w // 2,
+                                  cv2.BORDER_CONSTANT, value=0)
+    
+    def onnx_embedding(self, face_image, session=None):
+        """
+        Embed an already-cropped BGR face with the ONNX model
+        
+        Preprocessing mirrors DeepFace: letterbox to the model input size,
+        scale to [0, 1], keep BGR channel order.
+        """
+        session = session or self.onnx_session
+        padded = self.letterbox(face_image, self.onnx_input_size)
+        
+        # Scale + HWC->NCHW in one native call
+        blob = cv2.dnn.blobFromImage(padded, scalefactor=1.0 / 255)
+        if self.onnx_nhwc:
+            blob = blob.transpose(0, 2, 3, 1)
+        
+        return session.run(None, {self.onnx_input_name: blob})[0][0]
+    
+    def extract_face_embedding(self, image, cropped=False):
         """
         Extract face embedding from image using DeepFace
         
         Args:
-            image_path: Path to image file
+            image: Path to image file, or image array (BGR format)
+            cropped: Image is already cropped to the face - skip DeepFace's
+                     own detection and alignment steps
             
         Returns:
             embedding: Face embedding vector
         """
         try:
-            # Use DeepFace to extract embedding
+            if isinstance(image, (str, Path)):
+                source = str(image)
+            else:
+                source = image
+            
+            if self.face_app is not None:
+                if isinstance(source, str):
+                    image = cv2.imread(source)
+                    if image is None:
+                        return None
+                return self.insightface_embedding(image)
+            
+            if self.onnx_session is not None:
+                if isinstance(source, str):
+                    image = cv2.imread(source)
+                    if image is None:
+                        return None
+                return np.array(self.onnx_embedding(image))
+            
+            if cropped and not isinstance(source, str):
+                # Hand DeepFace a model-sized face instead of a full-resolution crop
+                width, height = DeepFace.build_model(self.model_name).input_shape
+                source = self.letterbox(source, (height, width))
+            
+            # Use DeepFace to extract embedding (it accepts arrays directly)
             embedding_objs = DeepFace.represent(
-                img_path=str(image_path),
+                img_path=source,
                 model_name=self.model_name,
-                enforce_detection=False
+                enforce_detection=False,
+                detector_backend='skip' if cropped else 'opencv',
+                align=not cropped
             )
             
             if embedding_objs and len(embedding_objs) > 0:
@@ -88,12 +768,51 @@ class FaceRecognitionSystem:
             return None
             
         except Exception as e:
-            print(f"Error extracting embedding from {image_path}: {e}")
+            label = source if isinstance(source, str) else 'image array'
+            print(f"Error extracting embedding from {label}: {e}")
+            return None
+    
+    def extract_face_embeddings_batch(self, face_crops):
+        """
+        Embed several already-cropped faces with a single model call
+        
+        Args:
+            face_crops: List of face image arrays (BGR format)
+            
+        Returns:
+            (N, D) array of embeddings, one row per crop, or None on failure
+        """
+        if len(face_crops) == 0:
+            return np.empty((0, 0), dtype=np.float32)
+        
+        try:
+            if self.face_app is not None:
+                # Each crop needs its own detection for alignment anyway
+                return np.stack([self.insightface_embedding(face) for face in face_crops])
+            
+            if self.onnx_session is not None:
+                padded = [self.letterbox(face, self.onnx_input_size) for face in face_crops]
+                blob = cv2.dnn.blobFromImages(padded, scalefactor=1.0 / 255)
+                if self.onnx_nhwc:
+                    blob = blob.transpose(0, 2, 3, 1)
+                return self.onnx_session.run(None, {self.onnx_input_name: blob})[0]
+            
+            # Run the model directly on one (N, H, W, 3) batch, skipping
+            # represent()'s per-image loading and detection
+            client = DeepFace.build_model(self.model_name)
+            width, height = client.input_shape
+            padded = [self.letterbox(face, (height, width)) for face in face_crops]
+            batch = cv2.dnn.blobFromImages(padded, scalefactor=1.0 / 255).transpose(0, 2, 3, 1)
+            return np.atleast_2d(np.asarray(client.forward(np.ascontiguousarray(batch)),
+                                            dtype=np.float32))
+            
+        except Exception as e:
+            print(f"Error extracting embeddings for {len(face_crops)} faces: {e}")
             return None
     
     def register_face(self, student_id, name, image_path, department=''):
         """
-        Register a new student face
+        Register a new student face (the cache is written by the next commit())
         
         Args:
             student_id: Unique student ID
@@ -123,10 +842,10 @@ class FaceRecognitionSystem:
                 return False
             
             if len(faces) > 1:
-                print(f"⚠️  Multiple faces detected, using first face")
+                print(f"⚠️  Multiple faces detected, using the largest face")
             
             # Extract face region
-            x, y, w, h = faces[0]
+            x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
             face_image = image[y:y+h, x:x+w]
             
             # Save registered face
@@ -134,16 +853,21 @@ class FaceRecognitionSystem:
             save_path = self.registered_faces_dir / filename
             cv2.imwrite(str(save_path), face_image)
             
-            # Extract and cache embedding
-            embedding = self.extract_face_embedding(save_path)
+            # Extract and cache embedding - from the crop in memory, which
+            # is already the detected face, so DeepFace needn't detect again
+            embedding = self.extract_face_embedding(face_image, cropped=True)
             if embedding is not None:
+                self.forget_disk_row(student_id)  # Re-registration replaces the old row
                 self.embeddings_cache[student_id] = {
-                    'embedding': embedding,
+                    'embedding': l2_normalize(embedding),
+                    'model': self.embedding_model,
+                    'hash': hashlib.sha1(save_path.read_bytes()).hexdigest(),
                     'name': name,
                     'department': department,
                     'image_path': str(save_path),
                     'registered_date': datetime.now().isoformat()
                 }
+                self.rebuild_matrix()
                 self.save_embeddings_cache()
                 
                 print(f"✅ Successfully registered: {name} (ID: {student_id})")
@@ -167,32 +891,50 @@ class FaceRecognitionSystem:
         Returns:
             dict: Recognition result with student_id, confidence, etc.
         """
-        try:
-            # Handle both file path and numpy array
-            if isinstance(image_path, str):
-                if not os.path.exists(image_path):
-                    return {'status': 'error', 'message': 'Image not found'}
-                image = cv2.imread(image_path)
-            else:
-                image = image_path
+        # Handle both file path and numpy array
+        if isinstance(image_path, (str, Path)):
+            if not os.path.exists(image_path):
+                return {'status': 'error', 'message': 'Image not found'}
+            image = cv2.imread(str(image_path))
+        else:
+            image = image_path
+        
+        return self.recognize_face_array(image, return_all_matches)
+    
+    def recognize_face_array(self, image, return_all_matches=False):
+        """
+        Recognize face from an in-memory frame (no disk round-trip)
+        
+        Args:
+            image: Image array (BGR format)
+            return_all_matches: If True, return all matches with scores
             
+        Returns:
+            dict: Recognition result with student_id, confidence, etc.
+        """
+        try:
             if image is None:
                 return {'status': 'error', 'message': 'Failed to read image'}
             
-            # Quick face detection
-            faces = self.detect_faces(image)
+            if self.face_app is not None:
+                # Detection and embedding in a single pass
+                analyzed = self.analyze(image)
+                faces = [box for box, _ in analyzed]
+            else:
+                # Quick face detection
+                faces = self.detect_faces(image)
             if len(faces) == 0:
                 return {
                     'status': 'no_face',
                     'message': 'No face detected in image'
                 }
             x, y, w, h = faces[0] # Get coordinates of the first face
-            # Save temporary image for DeepFace
-            temp_path = 'data/temp_capture.jpg'
-            cv2.imwrite(temp_path, image)
             
-            # Get embedding for captured face
-            captured_embedding = self.extract_face_embedding(temp_path)
+            # Get embedding for the captured face, straight from memory
+            if self.face_app is not None:
+                captured_embedding = analyzed[0][1]
+            else:
+                captured_embedding = self.extract_face_embedding(image[y:y+h, x:x+w], cropped=True)
             
             if captured_embedding is None:
                 return {
@@ -200,46 +942,14 @@ class FaceRecognitionSystem:
                     'message': 'Failed to extract face features'
                 }
             
-            # Compare with all registered faces
-            matches = []
+            # Compare with all registered faces in one matrix-vector product
+            rows = ()
+            if self.id_list:
+                k = len(self.id_list) if return_all_matches else MAX_MATCHES
+                similarities, rows = self.search(captured_embedding, k,
+                                                 min_similarity=1 - self.threshold)
             
-            for student_id, data in self.embeddings_cache.items():
-                registered_embedding = data['embedding']
-                
-                # Calculate cosine similarity
-                similarity = self.cosine_similarity(
-                    captured_embedding, 
-                    registered_embedding
-                )
-                
-                # Convert to distance (lower is better)
-                distance = 1 - similarity
-                
-                if distance < self.threshold:
-                    confidence = (1 - distance) * 100
-                    matches.append({
-                        'student_id': student_id,
-                        'name': data['name'],
-                        'department': data.get('department', ''),
-                        'confidence': round(confidence, 2),
-                        'distance': round(distance, 4)
-                    })
-            
-            # Sort by confidence (highest first)
-            # Sort by confidence (highest first)
-            matches.sort(key=lambda x: x['confidence'], reverse=True)
-            
-            # Clean up temp file
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-            
-            #
-            # !!! --- CHECK INDENTATION HERE --- !!!
-            #
-            # This 'if' block must be at the same level as 'matches.sort'
-            # and 'if os.path.exists'
-            #
-            if len(matches) == 0:
+            if len(rows) == 0:
                 return {
                     'status': 'unknown',
                     'message': 'Face not recognized',
@@ -247,21 +957,23 @@ class FaceRecognitionSystem:
                     'face_coords': [int(x), int(y), int(w), int(h)] # Our change
                 }
             
+            # Results come back most similar first
             if return_all_matches:
                 return {
                     'status': 'recognized',
-                    'matches': matches
+                    'matches': [self.match_details(i, similarity)
+                                for similarity, i in zip(similarities, rows)]
                 }
             else:
-                # Return best match
-                best_match = matches[0]
+                # Return best match - the only one that needs its details looked up
+                best_match = self.match_details(rows[0], similarities[0])
                 return {
                     'status': 'recognized',
                     'student_id': best_match['student_id'],
                     'name': best_match['name'],
                     'department': best_match['department'],
                     'confidence': best_match['confidence'],
-                    'all_matches': len(matches),
+                    'all_matches': len(rows),
                     'face_coords': [int(x), int(y), int(w), int(h)] # Our change
                 }
         except Exception as e:
@@ -271,40 +983,420 @@ class FaceRecognitionSystem:
                 'message': str(e)
             }
     
-    def cosine_similarity(self, embedding1, embedding2):
-        """Calculate cosine similarity between two embeddings"""
-        dot_product = np.dot(embedding1, embedding2)
-        norm1 = np.linalg.norm(embedding1)
-        norm2 = np.linalg.norm(embedding2)
-        return dot_product / (norm1 * norm2)
+    def recognize_many(self, face_crops):
+        """
+        Recognize several already-cropped faces, embedding them all in one
+        batched model call
+        
+        Args:
+            face_crops: List of face image arrays (BGR format)
+            
+        Returns:
+            list: One result per crop, in order - shaped like
+                  recognize_face_array's best-match result without face_coords
+        """
+        if len(face_crops) == 0:
+            return []
+        
+        embeddings = self.extract_face_embeddings_batch(face_crops)
+        if embeddings is None:
+            return [{'status': 'error', 'message': 'Failed to extract face features'}
+                    for _ in face_crops]
+        
+        results = []
+        for embedding in embeddings:
+            rows = ()
+            if self.id_list:
+                similarities, rows = self.search(embedding, MAX_MATCHES,
+                                                 min_similarity=1 - self.threshold)
+            if len(rows) == 0:
+                results.append({'status': 'unknown', 'message': 'Face not recognized', 'confidence': 0})
+                continue
+            
+            best_match = self.match_details(rows[0], similarities[0])
+            results.append({
+                'status': 'recognized',
+                'student_id': best_match['student_id'],
+                'name': best_match['name'],
+                'department': best_match['department'],
+                'confidence': best_match['confidence'],
+                'all_matches': len(rows)
+            })
+        return results
+    
+    def match_details(self, row, similarity):
+        """Describe the registered face at `row` of id_list as a match"""
+        # Convert to distance (lower is better)
+        distance = 1 - float(similarity)
+        student_id = self.id_list[row]
+        data = self.embeddings_cache[student_id]
+        return {
+            'student_id': student_id,
+            'name': data['name'],
+            'department': data.get('department', ''),
+            'confidence': round((1 - distance) * 100, 2),
+            'distance': round(distance, 4)
+        }
     
-    def load_embeddings_cache(self):
-        """Load cached embeddings from file"""
-        if os.path.exists(self.embeddings_cache_file):
-            try:
-                with open(self.embeddings_cache_file, 'rb') as f:
-                    self.embeddings_cache = pickle.load(f)
-                print(f"✅ Loaded {len(self.embeddings_cache)} cached embeddings")
-            except Exception as e:
-                print(f"⚠️  Failed to load cache: {e}")
-                self.embeddings_cache = {}
+    def rebuild_matrix(self):
+        """Stack the (already normalized) cached embeddings into an (N, D) matrix, rows ordered as id_list"""
+        self.id_list = list(self.embeddings_cache)
+        if not self.id_list:
+            self.emb_matrix = np.empty((0, 0), dtype=np.float32)
+            self.index = None
+            return
+        
+        # One contiguous float32 block - a single BLAS call scans every student
+        self.emb_matrix = np.ascontiguousarray(np.stack(
+            [self.embeddings_cache[sid]['embedding'] for sid in self.id_list],
+            dtype=np.float32
+        ))
+        # Cache entries share the matrix rows instead of holding copies
+        for sid, row in zip(self.id_list, self.emb_matrix):
+            self.embeddings_cache[sid]['embedding'] = row
+        self.build_index()
+    
+    def build_index(self):
+        """(Re)build the FAISS index over emb_matrix, if FAISS is available"""
+        self.index = None
+        matrix = self.emb_matrix
+        if faiss is None or not len(matrix):
+            return
+        if self.quantize_index:
+            # 8-bit codes scaled to each dimension's range - 4x less memory
+            # to scan per query, and the query itself stays float32
+            index = faiss.IndexScalarQuantizer(
+                matrix.shape[1], faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+            )
+            index.train(matrix)
         else:
+            index = faiss.IndexFlatIP(matrix.shape[1])
+        # Vectors are keyed by their emb_matrix row, so a single row can be
+        # removed or replaced without rebuilding the index
+        self.index = faiss.IndexIDMap(index)
+        self.index.add_with_ids(matrix, np.arange(len(matrix), dtype=np.int64))
+    
+    def remove_row(self, row):
+        """
+        Drop one row of emb_matrix/id_list by moving the last row into its
+        place - only that row is copied, not the rest of the matrix
+        """
+        last = len(self.id_list) - 1
+        if row != last:
+            self.emb_matrix[row] = self.emb_matrix[last]
+            moved = self.id_list[row] = self.id_list[last]
+            self.embeddings_cache[moved]['embedding'] = self.emb_matrix[row]
+        self.id_list.pop()
+        self.emb_matrix = self.emb_matrix[:last]
+        
+        if not self.id_list:
+            self.emb_matrix = np.empty((0, 0), dtype=np.float32)
+            self.index = None
+        elif self.index is not None:
+            self.index.remove_ids(np.array([row, last], dtype=np.int64))
+            if row != last:
+                self.index.add_with_ids(self.emb_matrix[row:row + 1],
+                                        np.array([row], dtype=np.int64))
+    
+    def search(self, embedding, k=MAX_MATCHES, min_similarity=-1.0):
+        """
+        Find the registered faces most similar to an embedding
+        
+        Args:
+            embedding: Query face embedding
+            k: Maximum number of faces to return
+            min_similarity: Only return faces more similar than this
+            
+        Returns:
+            (cosine similarities, row indices into id_list), most similar first
+        """
+        query = l2_normalize(embedding)
+        k = min(k, len(self.id_list))
+        
+        if self.index is not None:
+            similarities, rows = self.index.search(query[None, :], k)
+            # Quantization error can push a perfect match slightly past 1
+            similarities = np.minimum(similarities[0], 1.0)
+            keep = similarities > min_similarity
+            return similarities[keep], rows[0][keep]
+        
+        # Threshold first so only the (few) candidates are ranked, then
+        # partition out the top k before sorting just those
+        similarities = self.emb_matrix @ query
+        rows = np.where(similarities > min_similarity)[0]
+        if len(rows) > k:
+            rows = rows[np.argpartition(-similarities[rows], k - 1)[:k]]
+        rows = rows[np.argsort(-similarities[rows])]
+        return similarities[rows], rows
+    
+    def cache_is_stale(self):
+        """True when registered face images changed after the cache was written"""
+        try:
+            return (self.registered_faces_dir.stat().st_mtime >
+                    os.path.getmtime(self.embeddings_meta_file))
+        except OSError:
+            return False
+    
+    def load_embeddings_cache(self):
+        """Load cached embeddings - the matrix is memory-mapped, not read in"""
+        has_meta = os.path.exists(self.embeddings_meta_file)
+        has_legacy_meta = os.path.exists(self.legacy_meta_file)
+        if not has_meta and not has_legacy_meta and os.path.exists(self.legacy_cache_file):
+            self.migrate_legacy_cache()
+            has_meta = os.path.exists(self.embeddings_meta_file)
+        
+        if not has_meta and not has_legacy_meta:
             print("ℹ️  No existing cache found, will create new cache")
+            self.rebuild_matrix()
+            return
+        
+        try:
+            if has_meta:
+                entries, dead, generation = self.read_meta_file()
+            else:
+                # Written by older versions as a single JSON list, no tombstones
+                with open(self.legacy_meta_file, 'rb') as f:
+                    entries, dead, generation = orjson.loads(f.read()), set(), None
+                self._rewrite = True
+            
+            if entries:
+                # Copy-on-write: rows can be overwritten in memory (see
+                # delete_student) without touching the file
+                matrix = np.load(self.embeddings_file, mmap_mode='c')
+            else:
+                matrix = np.empty((0, 0), dtype=np.float32)
+            # Extra rows are from an append whose metadata never got written
+            if len(matrix) < len(entries):
+                raise ValueError(f"{len(matrix)} embeddings for {len(entries)} students")
+            
+            live = [row for row in range(len(entries)) if row not in dead]
+            # Without deleted rows the matrix stays memory-mapped
+            matrix = matrix[live] if dead else matrix[:len(entries)]
+            
+            self.embeddings_cache = {}
+            self._disk_row = {}
+            for emb, row in zip(matrix, live):
+                data = dict(entries[row])
+                data['embedding'] = emb
+                student_id = data.pop('student_id')
+                self.embeddings_cache[student_id] = data
+                self._disk_row[student_id] = row
+            self._disk_rows = len(entries)
+            self._disk_generation = generation
+            self.id_list = list(self.embeddings_cache)
+            self.emb_matrix = matrix
+            print(f"✅ Loaded {len(self.embeddings_cache)} cached embeddings")
+        except Exception as e:
+            print(f"⚠️  Failed to load cache: {e}")
+            self.embeddings_cache = {}
+            self.rebuild_cache()
+            return
+        
+        if self.cache_is_stale():
+            print("⚠️  Registered faces changed since the cache was saved")
+            self.rebuild_cache()
+        elif any(data.get('model', self.model_name) != self.embedding_model
+                 for data in self.embeddings_cache.values()):
+            print(f"⚠️  Cache was built with a different model than {self.embedding_model}")
+            self.rebuild_cache()
+        else:
+            self.build_index()
+            if self._rewrite:
+                self.save_embeddings_cache()
+                self.commit()
+    
+    def read_meta_file(self):
+        """
+        Parse the metadata file
+        
+        Returns:
+            tuple: (entries in row order, set of deleted rows, generation of the last commit)
+        """
+        entries, dead, generation = [], set(), None
+        for line in log_store.read_entries(self.embeddings_meta_file):
+            if 'generation' in line:
+                generation = line['generation']
+            elif 'deleted' in line:
+                dead.add(line['deleted'])
+            else:
+                entries.append(line)
+        return entries, dead, generation
+    
+    def disk_generation(self):
+        """Generation of the last commit to the metadata file (its last line - only the tail is read)"""
+        for entry in log_store.iter_entries_reversed(self.embeddings_meta_file):
+            return entry.get('generation')
+        return None
+    
+    def merge_from_disk(self):
+        """
+        Take in what other processes committed since this one read the
+        cache: their students are kept, and this process's registrations
+        and deletions are applied on top. Both files are then rewritten -
+        row numbers from the old read mean nothing in the new files.
+        """
+        try:
+            entries, dead, _ = self.read_meta_file()
+            matrix = np.load(self.embeddings_file) if entries else np.empty((0, 0), dtype=np.float32)
+            if len(matrix) < len(entries):
+                raise ValueError(f"{len(matrix)} embeddings for {len(entries)} students")
+        except Exception as e:
+            print(f"⚠️  Could not read the cache written by another process: {e}")
+            entries, dead = [], set()
+        
+        ours = {sid: self.embeddings_cache[sid] for sid in self.id_list if sid not in self._disk_row}
+        merged = {}
+        for row, entry in enumerate(entries):
+            data = dict(entry)
+            student_id = data.pop('student_id')
+            if row in dead or student_id in self._forgotten:
+                continue
+            data['embedding'] = matrix[row]
+            merged[student_id] = data
+        merged.update(ours)
+        
+        self.embeddings_cache = merged
+        self.rebuild_matrix()
+        self._rewrite = True
+        print(f"🔄 Merged embeddings cache changes from another process ({len(merged)} entries)")
+    
+    def migrate_legacy_cache(self):
+        """One-time conversion of the old pickled cache to .npy + JSON"""
+        try:
+            with open(self.legacy_cache_file, 'rb') as f:
+                self.embeddings_cache = pickle.load(f)
+            # Caches written by older versions hold raw embeddings
+            for data in self.embeddings_cache.values():
+                data['embedding'] = l2_normalize(data['embedding'])
+        except Exception as e:
+            print(f"⚠️  Could not read legacy cache {self.legacy_cache_file}: {e}")
+            self.embeddings_cache = {}
+            return
+        
+        self.rebuild_matrix()
+        self._rewrite = True
+        self.save_embeddings_cache()
+        self.commit()
+        print(f"📦 Migrated {len(self.embeddings_cache)} cached embeddings to {self.embeddings_file}")
     
     def save_embeddings_cache(self):
-        """Save embeddings cache to file"""
+        """Mark the embeddings cache as changed - it is written out by commit()"""
+        self._dirty = True
+    
+    def forget_disk_row(self, student_id):
+        """Schedule a student's row in the embeddings file to be marked deleted"""
+        row = self._disk_row.pop(student_id, None)
+        if row is not None:
+            self._tombstones.append(row)
+            self._forgotten.add(student_id)
+    
+    def meta_entry(self, student_id):
+        """A student's cache entry as written to the metadata file"""
+        return {'student_id': student_id,
+                **{k: v for k, v in self.embeddings_cache[student_id].items() if k != 'embedding'}}
+    
+    def commit(self):
+        """
+        Write out changes to the embeddings cache, if any - new rows are
+        appended to the .npy and metadata files, deletions are recorded as
+        tombstones, and both files are only rewritten once mostly dead
+        
+        Returns:
+            bool: Success status
+        """
+        if not self._dirty:
+            return True
         try:
-            os.makedirs(os.path.dirname(self.embeddings_cache_file), exist_ok=True)
-            with open(self.embeddings_cache_file, 'wb') as f:
-                pickle.dump(self.embeddings_cache, f)
+            os.makedirs(os.path.dirname(self.embeddings_file), exist_ok=True)
+            
+            # Pool workers migrate/rebuild at the same startup - one writer at a time
+            with file_lock(self.embeddings_file):
+                # Rows/tombstones are only valid against the files this process read
+                if not self._rewrite and self.disk_generation() != self._disk_generation:
+                    self.merge_from_disk()
+                pending = [sid for sid in self.id_list if sid not in self._disk_row]
+                dead_rows = self._disk_rows + len(pending) - len(self.id_list)
+                if (self._rewrite or dead_rows > max(COMPACT_MIN_DEAD_ROWS, len(self.id_list))
+                        or not self.append_to_disk(pending)):
+                    self.write_all_to_disk()
+            
+            self._dirty = False
             print(f"✅ Saved embeddings cache ({len(self.embeddings_cache)} entries)")
+            return True
         except Exception as e:
             print(f"❌ Failed to save cache: {e}")
+            return False
+    
+    def append_to_disk(self, pending):
+        """
+        Append the embeddings of `pending` students and any tombstones
+        
+        Returns:
+            bool: False if the files on disk can't be appended to
+        """
+        if not os.path.exists(self.embeddings_meta_file):
+            return False
+        if pending:
+            rows = np.stack([self.embeddings_cache[sid]['embedding'] for sid in pending])
+            if not append_npy_rows(self.embeddings_file, rows, self._disk_rows):
+                return False
+        
+        entries = ([{'deleted': row} for row in self._tombstones] +
+                   [self.meta_entry(sid) for sid in pending])
+        if entries:
+            generation = uuid.uuid4().hex
+            log_store.append_entries(self.embeddings_meta_file, entries + [{'generation': generation}])
+            self._disk_generation = generation
+        for sid in pending:
+            self._disk_row[sid] = self._disk_rows
+            self._disk_rows += 1
+        self._tombstones = []
+        self._forgotten = set()
+        return True
+    
+    def write_all_to_disk(self):
+        """Rewrite emb_matrix to .npy and the student details (in row order) to JSONL"""
+        # Write beside the old files (under names unique to this process)
+        # and swap in: the current matrix may be memory-mapped from the
+        # old .npy, which must not be truncated
+        tmp_path = temp_path_for(self.embeddings_file)
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.ascontiguousarray(self.emb_matrix, dtype=np.float32))
+            os.replace(tmp_path, self.embeddings_file)
+            
+            generation = uuid.uuid4().hex
+            tmp_path = temp_path_for(self.embeddings_meta_file)
+            with open(tmp_path, 'wb') as f:
+                f.write(b''.join(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE)
+                                 for entry in [*map(self.meta_entry, self.id_list),
+                                               {'generation': generation}]))
+            os.replace(tmp_path, self.embeddings_meta_file)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        
+        self._disk_rows = len(self.id_list)
+        self._disk_row = {sid: row for row, sid in enumerate(self.id_list)}
+        self._disk_generation = generation
+        self._tombstones = []
+        self._forgotten = set()
+        self._rewrite = False
     
     def rebuild_cache(self):
-        """Rebuild embeddings cache from registered faces directory"""
+        """
+        Rebuild embeddings cache from registered faces directory
+        
+        Images whose content (SHA-1) matches an embedding already computed
+        with the current model reuse it instead of running the model again.
+        """
         print("🔄 Rebuilding embeddings cache...")
+        previous = self.embeddings_cache
         self.embeddings_cache = {}
+        known_hashes = {
+            data['hash']: data['embedding'] for data in previous.values()
+            if 'hash' in data and data.get('model', self.model_name) == self.embedding_model
+        }
         
         image_files = list(self.registered_faces_dir.glob('*.jpg')) + \
                       list(self.registered_faces_dir.glob('*.png'))
@@ -319,23 +1411,54 @@ class FaceRecognitionSystem:
                     student_id = parts[0]
                     name = parts[1].replace('_', ' ')
                     
-                    print(f"Processing: {student_id} - {name}")
+                    data = image_path.read_bytes()
+                    digest = hashlib.sha1(data).hexdigest()
+                    embedding = known_hashes.get(digest)
+                    if embedding is None:
+                        print(f"Processing: {student_id} - {name}")
+                        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                        embedding = self.embed_registered_image(image) if image is not None else None
+                        if embedding is not None:
+                            known_hashes[digest] = embedding
                     
-                    embedding = self.extract_face_embedding(image_path)
                     if embedding is not None:
+                        # Keep details that are not encoded in the filename
+                        known = previous.get(student_id, {})
                         self.embeddings_cache[student_id] = {
-                            'embedding': embedding,
+                            'embedding': l2_normalize(embedding),
+                            'model': self.embedding_model,
+                            'hash': digest,
                             'name': name,
-                            'department': '',
+                            'department': known.get('department', ''),
                             'image_path': str(image_path),
-                            'registered_date': datetime.now().isoformat()
+                            'registered_date': known.get('registered_date',
+                                                         datetime.now().isoformat())
                         }
             except Exception as e:
                 print(f"⚠️  Error processing {image_path}: {e}")
         
+        self.rebuild_matrix()
+        self._rewrite = True
         self.save_embeddings_cache()
+        self.commit()
         print(f"✅ Cache rebuilt with {len(self.embeddings_cache)} entries")
     
+    def embed_registered_image(self, image):
+        """
+        Embed a registered face image through the same pipeline as
+        register_face and recognition: detect, crop the largest face and
+        embed the crop without DeepFace detecting or aligning it again
+        
+        Files saved by register_face already are that crop and are embedded
+        whole, so a rebuild reproduces the enrolment embedding.
+        """
+        faces = self.detect_faces(image)
+        if len(faces):
+            x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+            if w * h < TIGHT_CROP_MIN_FILL * image.shape[0] * image.shape[1]:
+                image = image[y:y+h, x:x+w]
+        return self.extract_face_embedding(image, cropped=True)
+    
     def get_registered_students(self):
         """Get list of all registered students"""
         students = []
@@ -349,15 +1472,20 @@ class FaceRecognitionSystem:
         return students
     
     def delete_student(self, student_id):
-        """Remove a student from the system"""
+        """Remove a student from the system (the cache is written by the next commit())"""
         if student_id in self.embeddings_cache:
             # Delete image file
             image_path = self.embeddings_cache[student_id].get('image_path')
+            if image_path:
+                # Older caches store paths relative to the project root
+                image_path = self.base_dir / image_path
             if image_path and os.path.exists(image_path):
                 os.remove(image_path)
             
             # Remove from cache
+            self.remove_row(self.id_list.index(student_id))
             del self.embeddings_cache[student_id]
+            self.forget_disk_row(student_id)
             self.save_embeddings_cache()
             
             print(f"✅ Deleted student: {student_id}")
@@ -4,11 +4,44 @@ Real-time face recognition with proper face matching
 """
 
 import cv2
-import json
-import os
-from datetime import datetime
+import atexit
+import queue
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from functools import lru_cache
 from pathlib import Path
-from face_recognition import FaceRecognitionSystem
+from face_recognition import FaceRecognitionSystem, PROJECT_ROOT
+import log_store
+from student_db import StudentDB
+
+# Batched log writes: flush at most every FLUSH_INTERVAL seconds,
+# or immediately once FLUSH_MAX_PENDING events are waiting
+FLUSH_INTERVAL = 0.5
+FLUSH_MAX_PENDING = 100
+
+# Unpaid/unknown captures are saved as WebP - smaller files than JPEG
+CAPTURE_WEBP_QUALITY = 85
+
+# A face box overlapping the last ALLOWED face this much, within this many
+# seconds of that recognition, is treated as the same person and not re-scanned
+SAME_PERSON_IOU = 0.7
+SAME_PERSON_WINDOW = 10
+
+
+@lru_cache(maxsize=256)
+def text_size(text, font_scale, thickness=2):
+    """cv2.getTextSize, memoized - the same label is drawn on every frame while a result is shown"""
+    return cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)[0]
+
+def _iou(a, b):
+    """Intersection-over-union of two (x, y, w, h) boxes"""
+    ix = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    iy = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    if ix <= 0 or iy <= 0:
+        return 0.0
+    inter = ix * iy
+    return inter / (a[2] * a[3] + b[2] * b[3] - inter)
 
 class LiveBusAccessSystem:
     def __init__(self, database_file='students_database.json', min_confidence=70.0):
@@ -16,20 +49,46 @@ class LiveBusAccessSystem:
         Initialize the live access system
         
         Args:
-            database_file: JSON database file path
+            database_file: Legacy JSON database path (relative to the project
+                           root) - students.db and the JSONL logs live next to it
             min_confidence: Minimum confidence % to accept recognition (default: 70%)
         """
         self.fr_system = FaceRecognitionSystem(threshold=0.4)  # Lower threshold for DeepFace
-        self.database_file = database_file
+        self.database_file = PROJECT_ROOT / database_file  # not the CWD - same files as the web app
+        self.student_db = StudentDB(self.database_file.with_name('students.db'), legacy_json=self.database_file)
+        # Event streams are appended to JSONL files next to the database
+        self.access_log_file = self.database_file.with_name('access_logs.jsonl')
+        self.captures_file = self.database_file.with_name('unpaid_captures.jsonl')
         self.cap = None
         self.min_confidence = min_confidence  # OUR confidence threshold
         
+        # Result currently shown on screen and the access log template -
+        # both are updated in place rather than rebuilt for every scan
+        self._last_result = {'status': None, 'name': None, 'confidence': 0, 'face_coords': (0, 0, 0, 0)}
+        self._log_entry = {'timestamp': None, 'student_id': None, 'name': None, 'status': None, 'confidence': 0}
+        
         # Create directories
         Path('data/unpaid_captures').mkdir(parents=True, exist_ok=True)
         
         # Load database
         self.load_database()
         
+        # Background writer - log events are batched and appended to the
+        # JSONL files instead of rewriting the whole database once per event
+        self._flush_lock = threading.Lock()
+        self._write_queue = deque()
+        self._write_event = threading.Event()
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
+        
+        # Capture images are encoded and written by their own thread so the
+        # live loop never waits on the disk
+        self._save_queue = queue.Queue()
+        self._save_thread = threading.Thread(target=self._save_worker, daemon=True)
+        self._save_thread.start()
+        atexit.register(self._save_queue.join)  # Runs before flush (LIFO)
+        
         # Colors (BGR format for OpenCV)
         self.GREEN = (0, 255, 0)
         self.RED = (0, 0, 255)
@@ -47,25 +106,55 @@ class LiveBusAccessSystem:
             print(f"  - {student['student_id']}: {student['name']}")
     
     def load_database(self):
-        """Load student database from JSON file"""
-        if os.path.exists(self.database_file):
-            with open(self.database_file, 'r') as f:
-                self.db = json.load(f)
-                self.students = self.db.get('students', {})
-        else:
-            print("⚠️  Database file not found! Creating new one...")
-            self.db = {
-                'students': {},
-                'access_logs': [],
-                'unpaid_captures': []
-            }
-            self.students = {}
-            self.save_database()
+        """Load student records from students.db"""
+        self.students = self.student_db.all_students()
+        if not self.students:
+            print("⚠️  No students in the database yet!")
+        
+        # Move logs recorded by older versions out of the JSON document
+        log_store.migrate_legacy_entries(self.database_file, 'access_logs', self.access_log_file)
+        log_store.migrate_legacy_entries(self.database_file, 'unpaid_captures', self.captures_file)
+    
+    def _queue_write(self, path, entry):
+        """Queue an entry for appending; the writer thread flushes in batches"""
+        self._write_queue.append((path, entry))
+        if len(self._write_queue) > FLUSH_MAX_PENDING:
+            self._write_event.set()
     
-    def save_database(self):
-        """Save database to JSON file"""
-        with open(self.database_file, 'w') as f:
-            json.dump(self.db, f, indent=2)
+    def _writer_loop(self):
+        """Background thread: periodically flush pending database writes"""
+        while True:
+            self._write_event.wait(FLUSH_INTERVAL)
+            self._write_event.clear()
+            self.flush()
+    
+    def flush(self):
+        """Append all pending log entries to their JSONL files"""
+        with self._flush_lock:
+            pending = {}
+            while self._write_queue:
+                path, entry = self._write_queue.popleft()
+                pending.setdefault(path, []).append(entry)
+            
+            for path, entries in pending.items():
+                try:
+                    log_store.append_entries(path, entries)
+                except Exception as e:
+                    print(f"❌ Error writing {path}: {e}")
+    
+    def _save_worker(self):
+        """Background thread: write queued capture images, then log them"""
+        while True:
+            filepath, image, capture_entry = self._save_queue.get()
+            try:
+                if cv2.imwrite(filepath, image, [cv2.IMWRITE_WEBP_QUALITY, CAPTURE_WEBP_QUALITY]):
+                    self._queue_write(self.captures_file, capture_entry)
+                else:
+                    print(f"❌ Could not save capture: {filepath}")
+            except Exception as e:
+                print(f"❌ Error saving capture {filepath}: {e}")
+            finally:
+                self._save_queue.task_done()
     
     def check_fee_status(self, student_id):
         """Check if student has paid fee"""
@@ -76,29 +165,35 @@ class LiveBusAccessSystem:
     
     def log_access(self, student_id, name, status, confidence=0):
         """Log access attempt"""
-        log_entry = {
-            'timestamp': datetime.now().isoformat(),
-            'student_id': student_id,
-            'name': name,
-            'status': status,
-            'confidence': confidence
-        }
-        self.db['access_logs'].append(log_entry)
-        self.save_database()
+        log_entry = self._log_entry
+        log_entry['timestamp'] = datetime.now().isoformat()
+        log_entry['student_id'] = student_id
+        log_entry['name'] = name
+        log_entry['status'] = status
+        log_entry['confidence'] = confidence
+        # Copy on enqueue - the writer thread serializes it later
+        self._queue_write(self.access_log_file, log_entry.copy())
+    
+    def set_last_result(self, status, name, confidence, face_coords):
+        """Update the on-screen result in place"""
+        last_result = self._last_result
+        last_result['status'] = status
+        last_result['name'] = name
+        last_result['confidence'] = confidence
+        last_result['face_coords'] = face_coords
     
     def save_unpaid_capture(self, image, student_id=None, name="Unknown"):
         """Save image of unpaid/unknown person"""
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         
         if student_id:
-            filename = f"unpaid_{student_id}_{timestamp}.jpg"
+            filename = f"unpaid_{student_id}_{timestamp}.webp"
         else:
-            filename = f"unknown_{timestamp}.jpg"
+            filename = f"unknown_{timestamp}.webp"
         
         filepath = f"data/unpaid_captures/{filename}"
-        cv2.imwrite(filepath, image)
         
-        # Log to database
+        # Logged by the save worker once the image is on disk
         capture_entry = {
             'timestamp': datetime.now().isoformat(),
             'student_id': student_id or 'UNKNOWN',
@@ -106,10 +201,11 @@ class LiveBusAccessSystem:
             'filename': filename,
             'filepath': filepath
         }
-        self.db['unpaid_captures'].append(capture_entry)
-        self.save_database()
+        # cap.read() returns a fresh array per frame, so the image is not
+        # modified after it is queued
+        self._save_queue.put((filepath, image, capture_entry))
         
-        print(f"📸 Saved capture: {filename}")
+        print(f"📸 Saving capture: {filename}")
         return filepath
     
     def draw_status_box(self, frame, x, y, w, h, status, name, confidence=0):
@@ -133,8 +229,8 @@ class LiveBusAccessSystem:
         
         # Calculate text size for background rectangle
         font = cv2.FONT_HERSHEY_SIMPLEX  # Use SIMPLEX instead of BOLD
-        (text_width, text_height), _ = cv2.getTextSize(text, font, 0.8, 2)
-        (detail_width, detail_height), _ = cv2.getTextSize(detail, font, 0.6, 2)
+        text_width, text_height = text_size(text, 0.8)
+        detail_width, detail_height = text_size(detail, 0.6)
         
         max_width = max(text_width, detail_width)
         
@@ -173,13 +269,16 @@ class LiveBusAccessSystem:
             print("❌ Could not open webcam!")
             return
         
-        # Set camera properties
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
+        # Set camera properties - 640x480 is plenty for detection and
+        # recognition, and keeps per-frame work down
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
         
         last_recognition_time = datetime.now()
         recognition_cooldown = 2  # seconds between recognitions
-        last_result = None
+        last_result = self._last_result
+        last_result['status'] = None
+        last_allowed_time = None
         show_result_until = None
         
         while True:
@@ -195,13 +294,13 @@ class LiveBusAccessSystem:
             faces = self.fr_system.detect_faces(frame)
             
             # If we're showing a result, keep showing it
-            if show_result_until and current_time < show_result_until and last_result:
+            if show_result_until and current_time < show_result_until and last_result['status']:
                 x, y, w, h = last_result['face_coords']
                 display_frame = self.draw_status_box(
                     display_frame, x, y, w, h,
                     last_result['status'],
                     last_result['name'],
-                    last_result.get('confidence', 0)
+                    last_result['confidence']
                 )
             else:
                 # Draw yellow box around detected faces (scanning mode)
@@ -213,16 +312,24 @@ class LiveBusAccessSystem:
             # Check if we should run recognition
             time_since_last = (current_time - last_recognition_time).total_seconds()
             
+            scan_due = len(faces) > 0 and time_since_last > recognition_cooldown
+            
+            # Same person still standing in front of the camera after being
+            # let in - keep showing the result instead of recognizing again
+            if (scan_due and last_result['status'] == 'ALLOWED'
+                    and (current_time - last_allowed_time).total_seconds() < SAME_PERSON_WINDOW
+                    and _iou(faces[0], last_result['face_coords']) > SAME_PERSON_IOU):
+                x, y, w, h = faces[0]
+                last_result['face_coords'] = (x, y, w, h)
+                last_recognition_time = current_time
+                show_result_until = current_time + timedelta(seconds=2)
+            
             # Auto-recognize if face detected and cooldown passed
-            if len(faces) > 0 and time_since_last > recognition_cooldown:
+            elif scan_due:
                 print(f"\n🔍 Face detected! Running recognition...")
                 
-                # Save temporary image
-                temp_path = 'data/temp_recognition.jpg'
-                cv2.imwrite(temp_path, frame)
-                
                 # USE FACE RECOGNITION SYSTEM TO MATCH WITH REGISTERED FACES
-                result = self.fr_system.recognize_face(temp_path)
+                result = self.fr_system.recognize_face_array(frame)
                 
                 # Get face coordinates for drawing
                 x, y, w, h = faces[0]
@@ -244,12 +351,7 @@ class LiveBusAccessSystem:
                         # Save their photo automatically
                         self.save_unpaid_capture(frame, None, f"Low_Conf_{name}")
                         
-                        last_result = {
-                            'status': 'UNKNOWN',
-                            'name': 'Unknown',
-                            'confidence': 0,
-                            'face_coords': (x, y, w, h)
-                        }
+                        self.set_last_result('UNKNOWN', 'Unknown', 0, (x, y, w, h))
                     else:
                         # CONFIDENCE HIGH ENOUGH - Check fee status
                         fee_paid = self.check_fee_status(student_id)
@@ -259,12 +361,8 @@ class LiveBusAccessSystem:
                             print(f"✅ ACCESS GRANTED: {name}")
                             self.log_access(student_id, name, "allowed", confidence)
                             
-                            last_result = {
-                                'status': 'ALLOWED',
-                                'name': name,
-                                'confidence': confidence,
-                                'face_coords': (x, y, w, h)
-                            }
+                            self.set_last_result('ALLOWED', name, confidence, (x, y, w, h))
+                            last_allowed_time = current_time
                             
                         else:
                             # DENIED - Registered but NOT Paid
@@ -274,12 +372,7 @@ class LiveBusAccessSystem:
                             # Save their photo
                             self.save_unpaid_capture(frame, student_id, name)
                             
-                            last_result = {
-                                'status': 'DENIED',
-                                'name': name,
-                                'confidence': confidence,
-                                'face_coords': (x, y, w, h)
-                            }
+                            self.set_last_result('DENIED', name, confidence, (x, y, w, h))
                 
                 else:
                     # UNKNOWN - Face did NOT match any registered face
@@ -289,19 +382,10 @@ class LiveBusAccessSystem:
                     # Save their photo automatically
                     self.save_unpaid_capture(frame, None, "Unknown")
                     
-                    last_result = {
-                        'status': 'UNKNOWN',
-                        'name': 'Unknown',
-                        'confidence': 0,
-                        'face_coords': (x, y, w, h)
-                    }
+                    self.set_last_result('UNKNOWN', 'Unknown', 0, (x, y, w, h))
                 
                 last_recognition_time = current_time
-                show_result_until = current_time + datetime.timedelta(seconds=2)
-                
-                # Clean up temp file
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
+                show_result_until = current_time + timedelta(seconds=2)
             
             # Display info on frame
             info_text = f"Faces Detected: {len(faces)}"
@@ -332,6 +416,8 @@ class LiveBusAccessSystem:
         # Cleanup
         self.cap.release()
         cv2.destroyAllWindows()
+        self._save_queue.join()
+        self.flush()
         
         # Show summary
         self.show_summary()
@@ -342,16 +428,19 @@ class LiveBusAccessSystem:
         print("📊 SESSION SUMMARY")
         print("=" * 60)
         
-        total_logs = len(self.db['access_logs'])
-        allowed = sum(1 for log in self.db['access_logs'] if log['status'] == 'allowed')
-        denied = sum(1 for log in self.db['access_logs'] if log['status'] == 'denied_unpaid')
-        unknown = sum(1 for log in self.db['access_logs'] if log['status'] == 'unrecognized')
+        access_logs = log_store.read_entries(self.access_log_file)
+        captures = log_store.read_entries(self.captures_file)
+        
+        total_logs = len(access_logs)
+        allowed = sum(1 for log in access_logs if log['status'] == 'allowed')
+        denied = sum(1 for log in access_logs if log['status'] == 'denied_unpaid')
+        unknown = sum(1 for log in access_logs if log['status'] == 'unrecognized')
         
         print(f"Total Scans: {total_logs}")
         print(f"✅ Allowed (Paid): {allowed}")
         print(f"❌ Denied (Unpaid): {denied}")
         print(f"❓ Unknown: {unknown}")
-        print(f"\n📸 Total captures saved: {len(self.db['unpaid_captures'])}")
+        print(f"\n📸 Total captures saved: {len(captures)}")
         print(f"📁 Location: data/unpaid_captures/")
         print("=" * 60)
 
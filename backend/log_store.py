@@ -0,0 +1,159 @@
+"""
+Append-only JSONL Log Store
+Keeps the ever-growing access_logs / unpaid_captures streams out of
+students_database.json so that recording one event is a single O(1) append
+"""
+
+import orjson
+import os
+import threading
+from collections import defaultdict
+from pathlib import Path
+
+# How much of the file to read per step when scanning backwards from the end
+TAIL_CHUNK_SIZE = 64 * 1024
+
+
+def append_entries(path, entries):
+    """Append entries to a JSONL file (one JSON object per line) in one write"""
+    if not entries:
+        return
+    options = orjson.OPT_APPEND_NEWLINE | orjson.OPT_SERIALIZE_NUMPY
+    data = b''.join(orjson.dumps(entry, option=options) for entry in entries)
+    with open(path, 'ab') as f:
+        f.write(data)
+
+
+def read_entries(path):
+    """Read every entry from a JSONL file, oldest first"""
+    entries = []
+    if not os.path.exists(path):
+        return entries
+    with open(path, 'rb') as f:
+        for line in f:
+            entry = _parse_line(line)
+            if entry is not None:
+                entries.append(entry)
+    return entries
+
+
+def iter_entries_reversed(path, chunk_size=TAIL_CHUNK_SIZE):
+    """
+    Yield entries newest first by reading the file backwards in chunks
+
+    Only the tail of the file is touched when the caller stops early,
+    so fetching the latest N entries costs the same regardless of file size.
+    """
+    if not os.path.exists(path):
+        return
+
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        remainder = b''
+
+        while pos > 0:
+            step = min(chunk_size, pos)
+            pos -= step
+            f.seek(pos)
+            lines = (f.read(step) + remainder).split(b'\n')
+            # First piece may be the tail end of a line that starts in the previous chunk
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                entry = _parse_line(line)
+                if entry is not None:
+                    yield entry
+
+        entry = _parse_line(remainder)
+        if entry is not None:
+            yield entry
+
+
+def read_tail(path, count):
+    """Return the last `count` entries, newest first"""
+    entries = []
+    for entry in iter_entries_reversed(path):
+        entries.append(entry)
+        if len(entries) >= count:
+            break
+    return entries
+
+
+def migrate_legacy_entries(database_file, key, path):
+    """
+    One-time move of a list stored inside students_database.json to JSONL
+
+    Does nothing once the JSONL file exists, so it is safe to call on every startup.
+    """
+    path = Path(path)
+    if path.exists() or not os.path.exists(database_file):
+        return
+
+    try:
+        with open(database_file, 'rb') as f:
+            legacy = orjson.loads(f.read()).get(key, [])
+    except Exception as e:
+        print(f"⚠️  Could not read legacy {key}: {e}")
+        return
+
+    path.touch()
+    append_entries(path, legacy)
+    if legacy:
+        print(f"📦 Migrated {len(legacy)} {key} entries to {path.name}")
+
+
+class DateIndex:
+    """
+    In-memory index of a JSONL log, bucketed by date (YYYY-MM-DD)
+
+    Built once, then kept current by reading only the bytes appended since
+    the last refresh - a dashboard poll never rescans the whole file.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.by_date = defaultdict(list)
+        self._offset = 0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Pick up entries appended since the last call"""
+        try:
+            size = self.path.stat().st_size
+        except FileNotFoundError:
+            size = 0
+
+        if size < self._offset:
+            # File was truncated or replaced - start over
+            self.by_date.clear()
+            self._offset = 0
+        if size == self._offset:
+            return
+
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+
+        # Leave a trailing half-written line for the next refresh
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].split(b'\n'):
+            entry = _parse_line(line)
+            if entry is not None:
+                self.by_date[entry.get('timestamp', '')[:10]].append(entry)
+        self._offset += end
+
+    def entries_for(self, date_str):
+        """Entries logged on the given date, oldest first"""
+        with self._lock:
+            self.refresh()
+            return list(self.by_date.get(date_str, ()))
+
+
+def _parse_line(line):
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        return orjson.loads(line)
+    except orjson.JSONDecodeError:
+        return None  # Half-written line from a concurrent append
@@ -0,0 +1,57 @@
+"""
+Recognition Worker Pool
+Runs face recognition in separate processes so web server threads never
+block on model inference. Each worker loads the model once at startup.
+"""
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Per-process FaceRecognitionSystem, created by the pool initializer
+_fr_system = None
+
+# Warm-up tasks submitted by create_pool (main process only) - a worker
+# only runs one after its initializer has loaded the model
+_warmups = []
+
+
+def _init_worker(base_dir, onnx_threads):
+    """Pool initializer: load the face recognition model once per worker"""
+    global _fr_system
+    from face_recognition import FaceRecognitionSystem
+    _fr_system = FaceRecognitionSystem(base_dir=base_dir, onnx_threads=onnx_threads)
+
+
+def _warmup():
+    """No-op task used to force workers to start (and load the model) early"""
+    return os.getpid()
+
+
+def is_ready():
+    """True once at least one worker has finished loading its model"""
+    return any(future.done() for future in _warmups)
+
+
+def recognize(frame):
+    """Recognize the face in a BGR frame using this worker's model"""
+    return _fr_system.recognize_face_array(frame)
+
+
+def create_pool(base_dir, max_workers=2):
+    """
+    Start the worker pool and begin loading models in the background
+
+    Uses the 'spawn' start method - forking a process that may already
+    hold TensorFlow state is not safe. The CPU cores are split between
+    the workers so their ONNX Runtime thread pools don't oversubscribe them.
+    """
+    onnx_threads = max(1, (os.cpu_count() or 1) // max_workers)
+    pool = ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(str(base_dir), onnx_threads)
+    )
+    _warmups[:] = [pool.submit(_warmup) for _ in range(max_workers)]
+    return pool
@@ -0,0 +1,159 @@
+"""
+SQLite Student Store
+One row per student in a WAL-mode sqlite3 file, so changing a fee status
+is a single-row UPDATE instead of rewriting the whole JSON document, and the
+live scanners can read while the manager writes
+"""
+
+import orjson
+import os
+import sqlite3
+import threading
+
+# Columns of the students table, in the order records were kept in the JSON file
+STUDENT_FIELDS = (
+    'name', 'roll_number', 'department', 'email', 'phone', 'fee_status',
+    'fee_paid_date', 'valid_until', 'face_registered', 'registered_date'
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+    student_id      TEXT PRIMARY KEY,
+    name            TEXT NOT NULL,
+    roll_number     TEXT NOT NULL DEFAULT '',
+    department      TEXT NOT NULL DEFAULT '',
+    email           TEXT NOT NULL DEFAULT '',
+    phone           TEXT NOT NULL DEFAULT '',
+    fee_status      TEXT NOT NULL DEFAULT 'unpaid',
+    fee_paid_date   TEXT NOT NULL DEFAULT '',
+    valid_until     TEXT NOT NULL DEFAULT '',
+    face_registered INTEGER NOT NULL DEFAULT 0,
+    registered_date TEXT NOT NULL DEFAULT ''
+)
+"""
+
+_COLUMNS = ', '.join(STUDENT_FIELDS)
+_SELECT = f"SELECT student_id, {_COLUMNS} FROM students"
+
+
+class StudentDB:
+    def __init__(self, path='students.db', legacy_json='students_database.json'):
+        """
+        Open (or create) the student database
+
+        Args:
+            path: sqlite3 database file
+            legacy_json: students_database.json to import from when the
+                         sqlite file is created for the first time
+        """
+        self.path = str(path)
+        first_run = not os.path.exists(self.path)
+
+        # One connection shared by all threads, serialized by the lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        with self._conn:
+            self._conn.execute(SCHEMA)
+
+        if first_run and legacy_json:
+            self.import_json(legacy_json)
+
+    def import_json(self, json_file):
+        """Copy the students of a students_database.json file into the table"""
+        if not os.path.exists(json_file):
+            return
+        try:
+            with open(json_file, 'rb') as f:
+                students = orjson.loads(f.read()).get('students', {})
+        except Exception as e:
+            print(f"⚠️  Could not read {json_file}: {e}")
+            return
+
+        for student_id, data in students.items():
+            self.upsert(student_id, data)
+        if students:
+            print(f"📦 Imported {len(students)} students from {json_file}")
+
+    @staticmethod
+    def _to_dict(row):
+        student = dict(zip(STUDENT_FIELDS, row[1:]))
+        student['face_registered'] = bool(student['face_registered'])
+        return student
+
+    def get(self, student_id):
+        """Return one student's record, or None if not found"""
+        with self._lock:
+            row = self._conn.execute(f"{_SELECT} WHERE student_id = ?", (student_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def all_students(self):
+        """Return {student_id: record} for every student, in registration order"""
+        with self._lock:
+            rows = self._conn.execute(f"{_SELECT} ORDER BY rowid").fetchall()
+        return {row[0]: self._to_dict(row) for row in rows}
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM students").fetchone()[0]
+
+    def is_paid(self, student_id):
+        """Check if a student has paid the fee"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM students WHERE student_id = ? AND fee_status = 'paid'",
+                (student_id,)
+            ).fetchone()
+        return row is not None
+
+    def upsert(self, student_id, data):
+        """Insert a student, or replace the record of an existing one"""
+        values = [data.get(field, '') for field in STUDENT_FIELDS]
+        values[STUDENT_FIELDS.index('face_registered')] = int(bool(data.get('face_registered')))
+        updates = ', '.join(f"{field} = excluded.{field}" for field in STUDENT_FIELDS)
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT INTO students (student_id, {_COLUMNS}) "
+                f"VALUES (?, {', '.join('?' * len(STUDENT_FIELDS))}) "
+                f"ON CONFLICT(student_id) DO UPDATE SET {updates}",
+                (student_id, *values)
+            )
+
+    def update_fee_status(self, student_id, fee_status, fee_paid_date='', valid_until=''):
+        """
+        Update a single student's fee fields
+
+        Returns:
+            bool: True if the student exists
+        """
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "UPDATE students SET fee_status = ?, fee_paid_date = ?, valid_until = ? "
+                "WHERE student_id = ?",
+                (fee_status, fee_paid_date, valid_until, student_id)
+            )
+        return cur.rowcount > 0
+
+    def delete(self, student_id):
+        """Delete a student; returns True if a row was removed"""
+        with self._lock, self._conn:
+            cur = self._conn.execute("DELETE FROM students WHERE student_id = ?", (student_id,))
+        return cur.rowcount > 0
+
+    def data_version(self):
+        """Changes whenever another connection commits - cheap cache invalidation"""
+        with self._lock:
+            return self._conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def dump_json(self, json_file):
+        """Export the students in the old students_database.json layout"""
+        with open(json_file, 'wb') as f:
+            f.write(orjson.dumps({'students': self.all_students()},
+                                 option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE))
+        print(f"💾 Exported {self.count()} students to {json_file}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -4,61 +4,80 @@ Register faces AND add to database in one go!
 """
 
 import cv2
-import json
 import os
+import threading
 from pathlib import Path
 from datetime import datetime
-from face_recognition import FaceRecognitionSystem
+from face_recognition import FaceRecognitionSystem, PROJECT_ROOT
+from student_db import StudentDB
+
+# The registration preview runs face detection on every Nth frame and
+# reuses the last boxes in between
+DETECT_EVERY = 3
+
+
+class FrameGrabber(threading.Thread):
+    """
+    Reads camera frames on a background thread and keeps only the newest,
+    so the preview loop never blocks on cap.read()
+    """
+    
+    def __init__(self, cap):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.stopped = False
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._ret, self._frame = False, None
+    
+    def run(self):
+        while not self.stopped:
+            ret, frame = self.cap.read()
+            with self._lock:
+                self._ret, self._frame = ret, frame
+            self._ready.set()
+            if not ret:
+                break
+    
+    def read(self, timeout=5.0):
+        """Return (ret, frame) for the latest frame, waiting only for the first one"""
+        self._ready.wait(timeout)
+        with self._lock:
+            return self._ret, self._frame
+    
+    def release(self):
+        """Stop the thread and release the camera"""
+        self.stopped = True
+        self.join(timeout=1.0)
+        self.cap.release()
 
 class StudentManager:
     def __init__(self):
         self.fr_system = FaceRecognitionSystem()
-        self.database_file = 'students_database.json'  # THIS is your file name
-        self.load_database()
+        # Same file as the web app, whatever directory this is started from
+        self.database_file = PROJECT_ROOT / 'students.db'
+        # Imported once from the old JSON file if it is still around
+        self.db = StudentDB(self.database_file, legacy_json=PROJECT_ROOT / 'students_database.json')
         
         print("✅ Student Manager Initialized!")
-        print(f"📁 Database file: {self.database_file}")
+        print(f"📁 Database file: {self.database_file} ({self.db.count()} students)")
     
     def load_database(self):
-        """Load database from students_database.json"""
-        if os.path.exists(self.database_file):
-            try:
-                with open(self.database_file, 'r', encoding='utf-8') as f:
-                    self.db = json.load(f)
-                print(f"✅ Loaded database: {len(self.db.get('students', {}))} students")
-            except Exception as e:
-                print(f"⚠️  Error loading database: {e}")
-                print("Creating new database...")
-                self.db = {
-                    'students': {},
-                    'access_logs': [],
-                    'unpaid_captures': []
-                }
-        else:
-            print("⚠️  No database file found. Creating new one...")
-            self.db = {
-                'students': {},
-                'access_logs': [],
-                'unpaid_captures': []
-            }
-        
-        self.students = self.db.get('students', {})
+        """No-op: records are read from students.db when needed"""
     
-    def save_database(self):
-        """Save database to students_database.json"""
-        try:
-            # Update students in database
-            self.db['students'] = self.students
-            
-            # Save with proper formatting
-            with open(self.database_file, 'w', encoding='utf-8') as f:
-                json.dump(self.db, f, indent=2, ensure_ascii=False)
-            
-            print(f"💾 Database saved to {self.database_file}")
-            return True
-        except Exception as e:
-            print(f"❌ Error saving database: {e}")
-            return False
+    def dump_json(self, json_file='students_database.json'):
+        """Export the student records as JSON"""
+        self.db.dump_json(json_file)
+    
+    def commit(self):
+        """
+        Write out the face embeddings changed by the current operation -
+        student rows are committed to students.db as they are written
+        
+        Returns:
+            bool: Success status
+        """
+        return self.fr_system.commit()
     
     def register_with_webcam(self):
         """Register student using webcam"""
@@ -73,7 +92,7 @@ class StudentManager:
             return
         
         # Check if already exists
-        if student_id in self.students:
+        if self.db.get(student_id):
             print(f"⚠️  Student {student_id} already exists!")
             overwrite = input("Overwrite? (y/n): ").strip().lower()
             if overwrite != 'y':
@@ -113,17 +132,28 @@ class StudentManager:
         if not cap.isOpened():
             print("❌ Could not open camera!")
             return
+        # A 960px-wide preview is plenty for registration and cheaper to move
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 960)
+        # Don't let the driver queue up stale frames
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        
+        grabber = FrameGrabber(cap)
+        grabber.start()
         
         captured = False
         temp_path = 'data/temp_registration.jpg'
+        frame_idx = 0
+        faces = []
         
         while True:
-            ret, frame = cap.read()
+            ret, frame = grabber.read()
             if not ret:
                 break
             
-            # Detect faces
-            faces = self.fr_system.detect_faces(frame)
+            # Detect faces (boxes from the last detection are shown in between)
+            if frame_idx % DETECT_EVERY == 0:
+                faces = self.fr_system.detect_faces(frame)
+            frame_idx += 1
             
             display = frame.copy()
             for (x, y, w, h) in faces:
@@ -148,7 +178,8 @@ class StudentManager:
             
             key = cv2.waitKey(1) & 0xFF
             
-            if key == 32 and len(faces) == 1:  # SPACE
+            # SPACE - re-detect so the capture is checked on this exact frame
+            if key == 32 and len(faces) == 1 and len(self.fr_system.detect_faces(frame)) == 1:
                 cv2.imwrite(temp_path, frame)
                 captured = True
                 print("✅ Image captured!")
@@ -157,7 +188,7 @@ class StudentManager:
                 print("❌ Cancelled!")
                 break
         
-        cap.release()
+        grabber.release()
         cv2.destroyAllWindows()
         
         if not captured:
@@ -178,9 +209,9 @@ class StudentManager:
                 os.remove(temp_path)
             return
         
-        # Add to database - THIS AUTOMATICALLY UPDATES students_database.json
+        # Add to database
         print("💾 Adding to database...")
-        self.students[student_id] = {
+        self.db.upsert(student_id, {
             'name': name,
             'roll_number': roll_number,
             'department': department,
@@ -191,10 +222,10 @@ class StudentManager:
             'valid_until': '2025-12-31' if fee_status == 'paid' else '',
             'face_registered': True,
             'registered_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        }
+        })
         
-        # SAVE TO students_database.json FILE
-        if self.save_database():
+        # Save the new face embedding
+        if self.commit():
             print("✅ Database file updated successfully!")
         else:
             print("❌ Warning: Database save failed!")
@@ -216,15 +247,17 @@ class StudentManager:
     
     def list_students(self):
         """List all registered students"""
+        students = self.db.all_students()
+        
         print("\n" + "=" * 60)
-        print(f"📋 REGISTERED STUDENTS ({len(self.students)})")
+        print(f"📋 REGISTERED STUDENTS ({len(students)})")
         print("=" * 60)
         
-        if not self.students:
+        if not students:
             print("No students registered yet!")
             return
         
-        for i, (student_id, data) in enumerate(self.students.items(), 1):
+        for i, (student_id, data) in enumerate(students.items(), 1):
             status = "✅ PAID" if data.get('fee_status') == 'paid' else "❌ UNPAID"
             print(f"\n{i}. {data['name']}")
             print(f"   ID: {student_id}")
@@ -238,43 +271,41 @@ class StudentManager:
         print("💰 UPDATE FEE STATUS")
         print("=" * 60)
         
-        if not self.students:
+        students = self.db.all_students()
+        if not students:
             print("No students registered!")
             return
         
         # Show list
         print("\nRegistered Students:")
-        for i, (sid, data) in enumerate(self.students.items(), 1):
+        for i, (sid, data) in enumerate(students.items(), 1):
             status = "PAID" if data.get('fee_status') == 'paid' else "UNPAID"
             print(f"{i}. {sid}: {data['name']} - {status}")
         
         student_id = input("\nEnter Student ID to update: ").strip()
         
-        if student_id not in self.students:
+        if student_id not in students:
             print(f"❌ Student {student_id} not found!")
             return
         
-        print(f"\nUpdating: {self.students[student_id]['name']}")
+        name = students[student_id]['name']
+        print(f"\nUpdating: {name}")
         print("1. Mark as PAID")
         print("2. Mark as UNPAID")
         
         choice = input("Select (1-2): ").strip()
         
+        # Single-row UPDATE - nothing else in the database is rewritten
         if choice == '1':
-            self.students[student_id]['fee_status'] = 'paid'
-            self.students[student_id]['fee_paid_date'] = datetime.now().strftime('%Y-%m-%d')
-            self.students[student_id]['valid_until'] = '2025-12-31'
-            print(f"✅ {self.students[student_id]['name']} marked as PAID")
+            self.db.update_fee_status(student_id, 'paid',
+                                      datetime.now().strftime('%Y-%m-%d'), '2025-12-31')
+            print(f"✅ {name} marked as PAID")
         elif choice == '2':
-            self.students[student_id]['fee_status'] = 'unpaid'
-            self.students[student_id]['fee_paid_date'] = ''
-            self.students[student_id]['valid_until'] = ''
-            print(f"❌ {self.students[student_id]['name']} marked as UNPAID")
+            self.db.update_fee_status(student_id, 'unpaid')
+            print(f"❌ {name} marked as UNPAID")
         else:
             print("Invalid choice!")
             return
-        
-        self.save_database()
     
     def delete_student(self):
         """Delete a student"""
@@ -282,22 +313,23 @@ class StudentManager:
         print("🗑️  DELETE STUDENT")
         print("=" * 60)
         
-        if not self.students:
+        students = self.db.all_students()
+        if not students:
             print("No students registered!")
             return
         
         # Show list
         print("\nRegistered Students:")
-        for i, (sid, data) in enumerate(self.students.items(), 1):
+        for i, (sid, data) in enumerate(students.items(), 1):
             print(f"{i}. {sid}: {data['name']}")
         
         student_id = input("\nEnter Student ID to delete: ").strip()
         
-        if student_id not in self.students:
+        if student_id not in students:
             print(f"❌ Student {student_id} not found!")
             return
         
-        name = self.students[student_id]['name']
+        name = students[student_id]['name']
         
         print(f"\n⚠️  WARNING: This will delete:")
         print(f"   • {name} from database")
@@ -311,11 +343,11 @@ class StudentManager:
             return
         
         # Delete from database
-        del self.students[student_id]
-        self.save_database()
+        self.db.delete(student_id)
         
         # Delete face recognition data
         success = self.fr_system.delete_student(student_id)
+        self.commit()
         
         if success:
             print(f"\n✅ {name} deleted successfully!")
@@ -332,9 +364,10 @@ class StudentManager:
             print("2. 📋 List All Students")
             print("3. 💰 Update Fee Status")
             print("4. 🗑️  Delete Student")
-            print("5. ❌ Exit")
+            print("5. 📤 Export Database to JSON")
+            print("6. ❌ Exit")
             
-            choice = input("\nSelect option (1-5): ").strip()
+            choice = input("\nSelect option (1-6): ").strip()
             
             if choice == '1':
                 self.register_with_webcam()
@@ -345,6 +378,8 @@ class StudentManager:
             elif choice == '4':
                 self.delete_student()
             elif choice == '5':
+                self.dump_json()
+            elif choice == '6':
                 print("\n👋 Goodbye!")
                 break
             else:
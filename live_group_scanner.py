@@ -5,24 +5,142 @@ MUCH FASTER face recognition!
 """
 
 import cv2
-import json
 import os
+import queue
+import sys
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
-from face_recognition import FaceRecognitionSystem
+from typing import NamedTuple
 import numpy as np
 
+# Face recognition and the student database live in backend/
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'backend'))
+from face_recognition import FaceRecognitionSystem, DET_SCALE, PROJECT_ROOT
+from student_db import StudentDB
+
+# Numba is optional - without it the dHash bits are packed with NumPy
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Faces whose 64-bit dHashes differ in at most this many bits are treated
+# as the same face by the session cache
+HASH_MAX_DISTANCE = 8
+
+# The live preview boxes are detected on a quarter-resolution frame (too
+# coarse for faces under ~96px); scans always detect at the default scale
+PREVIEW_DETECT_SCALE = 0.25
+
+# Marked group-scan images are encoded in memory at this JPEG quality,
+# with optimized Huffman tables
+SCAN_JPEG_QUALITY = 85
+
+# A face box overlapping a box from the previous scan by more than this
+# IoU is taken to be the same person and keeps that scan's label
+IOU_REUSE_THRESHOLD = 0.6
+
+# A session-cache hit also needs the face box to overlap the cached face's
+# box by at least this IoU - a 64-bit dHash of a tiny thumbnail can collide
+# between two different people, who are not standing in the same place
+CACHE_MIN_IOU = 0.3
+
+
+class FaceResult(NamedTuple):
+    """Outcome of one face in a group scan"""
+    coords: tuple  # (x, y, w, h)
+    student_id: str
+    name: str
+    confidence: float
+    status: str  # 'paid' or 'unpaid'
+    color: tuple  # BGR box color
+    label: str
+    recognized_at: datetime  # when the model last actually recognized this face
+
+
+def box_iou(a, b):
+    """Intersection over union of two (x, y, w, h) boxes"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = min(ax + aw, bx + bw) - max(ax, bx)
+    ih = min(ay + ah, by + bh) - max(ay, by)
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    inter = iw * ih
+    return inter / (aw * ah + bw * bh - inter)
+
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def _dhash64(gray):
+        """64-bit dHash of an 8x9 gray thumbnail: bit r*8+c is set when pixel (r, c+1) is brighter than (r, c)"""
+        h = np.uint64(0)
+        for r in range(8):
+            for c in range(8):
+                if gray[r, c + 1] > gray[r, c]:
+                    h |= np.uint64(1) << np.uint64(r * 8 + c)
+        return h
+
+    @njit(cache=True)
+    def _dhash64_many(grays):
+        """_dhash64 of each thumbnail in an (N, 8, 9) stack"""
+        hashes = np.empty(grays.shape[0], dtype=np.uint64)
+        for i in range(grays.shape[0]):
+            hashes[i] = _dhash64(grays[i])
+        return hashes
+else:
+    def _dhash64(gray):
+        """64-bit dHash of an 8x9 gray thumbnail: bit r*8+c is set when pixel (r, c+1) is brighter than (r, c)"""
+        diff = gray[:, 1:] > gray[:, :-1]
+        return np.packbits(diff.ravel(), bitorder='little').view('<u8')[0]
+
+    def _dhash64_many(grays):
+        """_dhash64 of each thumbnail in an (N, 8, 9) stack"""
+        diff = grays[:, :, 1:] > grays[:, :, :-1]
+        return np.packbits(diff.reshape(len(grays), -1), axis=1, bitorder='little').view('<u8').reshape(-1)
+
 class LiveGroupScanner:
-    def __init__(self, database_file='students_database.json', min_confidence=70.0):
-        """Initialize live group scanner"""
+    def __init__(self, database_file='students_database.json', min_confidence=70.0, verbose=False):
+        """Initialize live group scanner (verbose: print a line per face on every scan)"""
         self.fr_system = FaceRecognitionSystem(threshold=0.5)  # Slightly relaxed for speed
-        self.database_file = database_file
+        self.database_file = PROJECT_ROOT / database_file  # not the CWD - same files as the web app
+        self.student_db = StudentDB(self.database_file.with_name('students.db'), legacy_json=self.database_file)
         self.min_confidence = min_confidence
+        self.verbose = verbose
         self.cap = None
         
-        # Session cache - remember recognized faces during this session
-        self.session_cache = {}
+        # Session cache - remember recognized faces during this session,
+        # (face hash, box it was recognized in) -> entry, looked up by
+        # Hamming distance and box overlap, and kept in least-recently-used
+        # order so the oldest entry is evicted first
+        self.session_cache = OrderedDict()
         self.cache_timeout = 10  # Increased from 5 to 10 seconds - remember faces longer
+        self._cache_max = 256
+        self._cache_sweep_every = 200  # scans between sweeps of expired entries
+        self._scan_count = 0
+        
+        # Results of the previous SPACE scan - faces that have not moved
+        # reuse these without being hashed or recognized again
+        self._last_scan_results = []
+        
+        # Background face detection for the live preview: the display loop
+        # publishes its newest frame and reads back the latest boxes
+        self._frame_lock = threading.Lock()
+        self._detect_lock = threading.Lock()  # the Haar cascade is shared - one caller at a time
+        self._latest_frame = None
+        self._latest_faces = []
+        self._frame_ready = threading.Event()
+        self._stop_detection = threading.Event()
+        
+        # Scan images and reports are written by a background thread, so
+        # saving never holds up the SPACE path
+        self._io_queue = queue.Queue()
+        threading.Thread(target=self._io_worker, daemon=True).start()
+        
+        # Compile the hash kernels now rather than on the first scan
+        _dhash64_many(np.zeros((1, 8, 9), dtype=np.uint8))
         
         # Create output directory
         Path('data/group_scans').mkdir(parents=True, exist_ok=True)
@@ -37,99 +155,216 @@ class LiveGroupScanner:
         self.WHITE = (255, 255, 255)
         self.BLACK = (0, 0, 0)
         
+        # Label text metrics - the labels come from a small fixed set
+        self._text_size_cache = {}
+        
+        # Black strip blended under the info panel, sized on first draw
+        self._panel_dark = None
+        
+        # One throwaway recognition so the first SPACE press doesn't pay for
+        # model loading and thread-pool start-up
+        try:
+            self.fr_system.recognize_many([np.zeros((100, 100, 3), dtype=np.uint8)])
+        except Exception as e:
+            print(f"⚠️  Model warm-up failed: {e}")
+        
         print("✅ Live Group Scanner Initialized!")
         print(f"📋 Loaded {len(self.students)} registered students")
         print(f"🎯 Minimum confidence: {self.min_confidence}%")
         print(f"⚡ Speed optimization: ENABLED")
     
     def load_database(self):
-        """Load student database"""
-        if os.path.exists(self.database_file):
-            with open(self.database_file, 'r') as f:
-                self.db = json.load(f)
-                self.students = self.db.get('students', {})
-        else:
-            print("⚠️  No database found!")
-            self.students = {}
+        """Load student records from students.db"""
+        self.students = self.student_db.all_students()
+        if not self.students:
+            print("⚠️  No students in the database!")
+        
+        # Rebuilt on every load so check_fee_status is a single set lookup
+        self._paid_ids = frozenset(
+            sid for sid, s in self.students.items() if s.get('fee_status') == 'paid'
+        )
     
     def check_fee_status(self, student_id):
         """Check if student has paid fee"""
-        if student_id in self.students:
-            return self.students[student_id].get('fee_status') == 'paid'
-        return False
+        return student_id in self._paid_ids
     
     def compute_face_hash(self, face_region):
         """
-        Create a simple hash of face region for caching
-        This helps recognize same person without full AI recognition every frame
+        Create a perceptual hash (dHash) of face region for caching
+        This helps recognize same person without full AI recognition every frame -
+        sensor noise and small movements flip only a few of the 64 bits
+        """
+        return self.compute_face_hashes([face_region])[0]
+    
+    def compute_face_hashes(self, face_regions):
+        """
+        dHash of several face regions (BGR or grayscale) at once
+        
+        Returns:
+            List of 64-bit ints, one per region
         """
-        # Resize to small size for fast comparison
-        small = cv2.resize(face_region, (50, 50))
-        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
-        # Simple hash based on average pixel values
-        return hash(tuple(gray.flatten()[::10]))  # Sample every 10th pixel
+        # 9x8 gray thumbnails: each bit says whether a pixel is brighter than its left neighbour.
+        # Stacked as one (N*8, 9) image so a single cvtColor and hash call cover every face
+        small = np.vstack([cv2.resize(region, (9, 8), interpolation=cv2.INTER_AREA)
+                           for region in face_regions])
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        grays = small.reshape(-1, 8, 9)
+        return [int(h) for h in _dhash64_many(grays)]
     
-    def get_cached_result(self, face_hash):
-        """Check if we've recently recognized this face"""
-        if face_hash in self.session_cache:
-            cached = self.session_cache[face_hash]
+    def get_cached_result(self, face_hash, coords):
+        """
+        Check if we've recently recognized this face (or one that looks
+        almost identical) at about the same place in the frame
+        
+        Args:
+            face_hash: 64-bit dHash of the face
+            coords: (x, y, w, h) box of the face in this frame
+        """
+        now = datetime.now()
+        best_key, best_distance = None, HASH_MAX_DISTANCE + 1
+        for key, cached in self.session_cache.items():
+            distance = (face_hash ^ key[0]).bit_count()
             # Check if cache is still valid (within timeout)
-            time_diff = (datetime.now() - cached['timestamp']).total_seconds()
-            if time_diff < self.cache_timeout:
-                return cached['result']
-        return None
+            if (distance < best_distance and
+                    (now - cached['timestamp']).total_seconds() < self.cache_timeout and
+                    box_iou(coords, cached['result'].coords) >= CACHE_MIN_IOU):
+                best_key, best_distance = key, distance
+        
+        if best_key is None:
+            return None
+        cached = self.session_cache[best_key]
+        # Follow the face as it moves, so the next hit is checked against this box
+        cached['result'] = cached['result']._replace(coords=coords)
+        self.session_cache.move_to_end(best_key)
+        return cached['result']
+    
+    def add_cached_result(self, face_hash, result):
+        """Remember a recognition result, evicting the least recently used entry when full"""
+        # Keyed on the box too - a colliding hash elsewhere in the frame is
+        # someone else and must not replace this entry
+        key = (face_hash, result.coords)
+        self.session_cache[key] = {
+            'result': result,
+            'timestamp': datetime.now()
+        }
+        self.session_cache.move_to_end(key)
+        while len(self.session_cache) > self._cache_max:
+            self.session_cache.popitem(last=False)
+    
+    def sweep_session_cache(self):
+        """Drop cache entries that have outlived cache_timeout"""
+        now = datetime.now()
+        expired = [key for key, cached in self.session_cache.items()
+                   if (now - cached['timestamp']).total_seconds() >= self.cache_timeout]
+        for key in expired:
+            del self.session_cache[key]
     
-    def recognize_all_faces(self, frame):
+    def detect_faces(self, frame, scale=DET_SCALE, gray_frame=None):
+        """Detect faces, serialized with the background detection thread (boxes in full-frame coordinates)"""
+        with self._detect_lock:
+            return self.fr_system.detect_faces(frame, scale=scale, gray=gray_frame)
+    
+    def _detect_worker(self):
+        """Background thread: detect faces on the newest frame and publish the boxes"""
+        while not self._stop_detection.is_set():
+            if not self._frame_ready.wait(0.1):
+                continue
+            self._frame_ready.clear()
+            with self._frame_lock:
+                frame = self._latest_frame
+            self._latest_faces = self.detect_faces(frame, PREVIEW_DETECT_SCALE)
+    
+    def recognize_all_faces(self, frame, gray_frame=None, faces=None):
         """
         Recognize all faces in the frame - OPTIMIZED VERSION
         Returns list of results for each face
+        
+        gray_frame: grayscale copy of frame, shared by detection and hashing
+        faces: boxes already detected on this frame at DET_SCALE (None = detect here)
         """
+        if gray_frame is None:
+            gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        
         # Detect all faces
-        faces = self.fr_system.detect_faces(frame)
+        if faces is None:
+            faces = self.detect_faces(frame, gray_frame=gray_frame)
         
         if len(faces) == 0:
             return []
         
-        print(f"⚡ Processing {len(faces)} face(s)...")
-        results = []
+        self._scan_count += 1
+        if self._scan_count % self._cache_sweep_every == 0:
+            self.sweep_session_cache()
+        
+        results = [None] * len(faces)
+        cache_hits = 0
+        pending = []  # (index, coords, face hash, face crop) still to recognize
+        
+        # Results from the previous scan only count while their recognition
+        # is fresh - reusing one must not extend it
+        now = datetime.now()
+        previous = [prev for prev in self._last_scan_results
+                    if (now - prev.recognized_at).total_seconds() < self.cache_timeout]
         
-        # Process each face
+        # Same box as last scan - same person, skip hashing altogether
+        untracked = []
         for i, (x, y, w, h) in enumerate(faces):
-            # Extract face region
+            coords = (x, y, w, h)
+            tracked = next((prev for prev in previous
+                            if box_iou(coords, prev.coords) > IOU_REUSE_THRESHOLD), None)
+            if tracked is not None:
+                if self.verbose:
+                    print(f"  Face {i+1}: 📌 Not moved since last scan")
+                results[i] = tracked._replace(coords=coords)
+            else:
+                untracked.append(i)
+        
+        # Calculate face hashes for caching, all faces in one go, from the gray frame
+        face_hashes = self.compute_face_hashes(
+            [gray_frame[y:y+h, x:x+w] for x, y, w, h in (faces[i] for i in untracked)]
+        ) if untracked else []
+        
+        # First pass - answer what we can from the cache
+        for i, face_hash in zip(untracked, face_hashes):
+            x, y, w, h = faces[i]
             face_region = frame[y:y+h, x:x+w]
             
-            # Calculate face hash for caching
-            face_hash = self.compute_face_hash(face_region)
-            
             # Check cache first - SPEED BOOST!
-            cached_result = self.get_cached_result(face_hash)
+            cached_result = self.get_cached_result(face_hash, (x, y, w, h))
             if cached_result:
-                print(f"  Face {i+1}: ⚡ Using cached result")
+                if self.verbose:
+                    print(f"  Face {i+1}: ⚡ Using cached result")
                 # Update coordinates but keep cached recognition
-                cached_result['coords'] = (x, y, w, h)
-                results.append(cached_result)
+                results[i] = cached_result._replace(coords=(x, y, w, h))
+                cache_hits += 1
                 continue
             
-            # Not in cache - do full recognition
-            print(f"  Face {i+1}: 🔍 Recognizing...")
+            # Not in cache - queue for full recognition
+            if self.verbose:
+                print(f"  Face {i+1}: 🔍 Recognizing...")
             
             # OPTIMIZATION: Resize face for faster recognition
             # Smaller image = faster processing
             target_size = 200  # Reduce from original size
-            if w > target_size or h > target_size:
+            if 300 <= max(w, h) <= 500:
+                # Close enough to 2x - a single pyrDown is the cheapest halving
+                face_region_resized = cv2.pyrDown(face_region)
+            elif w > target_size or h > target_size:
                 scale = target_size / max(w, h)
                 new_w, new_h = int(w * scale), int(h * scale)
-                face_region_resized = cv2.resize(face_region, (new_w, new_h))
+                face_region_resized = cv2.resize(face_region, (new_w, new_h),
+                                                 interpolation=cv2.INTER_AREA)
             else:
                 face_region_resized = face_region
             
-            # Save temporary face
-            temp_path = f'data/temp_face_{i}.jpg'
-            cv2.imwrite(temp_path, face_region_resized)
-            
-            # Recognize face
-            recognition_result = self.fr_system.recognize_face(temp_path)
-            
+            pending.append((i, (x, y, w, h), face_hash, face_region_resized))
+        
+        # Recognize every uncached face with one batched model call
+        recognitions = self.fr_system.recognize_many([crop for _, _, _, crop in pending])
+        
+        # Second pass - turn recognitions into results, in frame order
+        for (i, (x, y, w, h), face_hash, _), recognition_result in zip(pending, recognitions):
             # Determine status
             if recognition_result['status'] == 'recognized':
                 student_id = recognition_result['student_id']
@@ -146,68 +381,82 @@ class LiveGroupScanner:
                         status = 'paid'
                         color = self.GREEN
                         label = 'PAID'
-                        print(f"    ✅ {name} - PAID ({confidence:.1f}%)")
+                        if self.verbose:
+                            print(f"  Face {i+1}: ✅ {name} - PAID ({confidence:.1f}%)")
                     else:
                         # UNPAID
                         status = 'unpaid'
                         color = self.RED
                         label = 'UNPAID'
-                        print(f"    ❌ {name} - UNPAID ({confidence:.1f}%)")
+                        if self.verbose:
+                            print(f"  Face {i+1}: ❌ {name} - UNPAID ({confidence:.1f}%)")
                     
-                    result = {
-                        'coords': (x, y, w, h),
-                        'student_id': student_id,
-                        'name': name,
-                        'confidence': confidence,
-                        'status': status,
-                        'color': color,
-                        'label': label
-                    }
+                    result = FaceResult(
+                        coords=(x, y, w, h),
+                        student_id=student_id,
+                        name=name,
+                        confidence=confidence,
+                        status=status,
+                        color=color,
+                        label=label,
+                        recognized_at=now
+                    )
                 else:
                     # LOW CONFIDENCE - treat as unknown
-                    print(f"    ⚠️  Low confidence ({confidence:.1f}% < {self.min_confidence}%)")
-                    result = {
-                        'coords': (x, y, w, h),
-                        'student_id': 'UNKNOWN',
-                        'name': 'Unknown',
-                        'confidence': confidence,
-                        'status': 'unpaid',
-                        'color': self.RED,
-                        'label': 'UNPAID'
-                    }
+                    if self.verbose:
+                        print(f"  Face {i+1}: ⚠️  Low confidence ({confidence:.1f}% < {self.min_confidence}%)")
+                    result = FaceResult(
+                        coords=(x, y, w, h),
+                        student_id='UNKNOWN',
+                        name='Unknown',
+                        confidence=confidence,
+                        status='unpaid',
+                        color=self.RED,
+                        label='UNPAID',
+                        recognized_at=now
+                    )
             else:
                 # NOT RECOGNIZED
-                print(f"    ❌ Not recognized")
-                result = {
-                    'coords': (x, y, w, h),
-                    'student_id': 'UNKNOWN',
-                    'name': 'Unknown',
-                    'confidence': 0,
-                    'status': 'unpaid',
-                    'color': self.RED,
-                    'label': 'UNPAID'
-                }
+                if self.verbose:
+                    print(f"  Face {i+1}: ❌ Not recognized")
+                result = FaceResult(
+                    coords=(x, y, w, h),
+                    student_id='UNKNOWN',
+                    name='Unknown',
+                    confidence=0,
+                    status='unpaid',
+                    color=self.RED,
+                    label='UNPAID',
+                    recognized_at=now
+                )
             
             # Add to cache
-            self.session_cache[face_hash] = {
-                'result': result,
-                'timestamp': datetime.now()
-            }
-            
-            results.append(result)
+            self.add_cached_result(face_hash, result)
             
-            # Clean up temp file
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+            results[i] = result
         
+        self._last_scan_results = results
+        
+        unmoved = len(faces) - len(untracked)
+        print(f"⚡ {len(faces)} face(s): {unmoved} unmoved, {cache_hits} cached, "
+              f"{len(pending)} recognized")
         return results
     
+    def _tsize(self, text, scale):
+        """(width, height) of text drawn at the given scale, measured once per label"""
+        key = (text, scale)
+        size = self._text_size_cache.get(key)
+        if size is None:
+            size = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, 2)[0]
+            self._text_size_cache[key] = size
+        return size
+    
     def draw_face_box(self, frame, result):
         """Draw bounding box and label for one face"""
-        x, y, w, h = result['coords']
-        color = result['color']
-        label = result['label']
-        name = result['name']
+        x, y, w, h = result.coords
+        color = result.color
+        label = result.label
+        name = result.name
         
         # Draw thick rectangle
         cv2.rectangle(frame, (x, y), (x+w, y+h), color, 4)
@@ -222,8 +471,8 @@ class LiveGroupScanner:
         
         # Calculate sizes
         font = cv2.FONT_HERSHEY_SIMPLEX
-        (top_w, top_h), _ = cv2.getTextSize(top_text, font, 0.8, 2)
-        (bot_w, bot_h), _ = cv2.getTextSize(bottom_text, font, 0.6, 2)
+        top_w, top_h = self._tsize(top_text, 0.8)
+        bot_w, bot_h = self._tsize(bottom_text, 0.6)
         
         max_width = max(top_w, bot_w) + 20
         
@@ -254,10 +503,12 @@ class LiveGroupScanner:
         """Draw information panel at top of frame"""
         height, width = frame.shape[:2]
         
-        # Semi-transparent background
-        overlay = frame.copy()
-        cv2.rectangle(overlay, (0, 0), (width, 80), self.BLACK, -1)
-        cv2.addWeighted(overlay, 0.6, frame, 0.4, 0, frame)
+        # Semi-transparent background - blend only the panel strip, in place
+        # (rows 0-80 inclusive, the area the filled rectangle used to cover)
+        panel = frame[0:81]
+        if self._panel_dark is None or self._panel_dark.shape != panel.shape:
+            self._panel_dark = np.zeros_like(panel)
+        cv2.addWeighted(panel, 0.4, self._panel_dark, 0.6, 0, dst=panel)
         
         # Title - Fixed display
         title = "LIVE GROUP SCANNER" if not scan_mode else "SCANNING..."
@@ -288,35 +539,57 @@ class LiveGroupScanner:
         filename = f"group_scan_{timestamp}.jpg"
         filepath = f"data/group_scans/{filename}"
         
-        cv2.imwrite(filepath, frame)
-        
         # Also save a text report
         report_filename = f"group_scan_{timestamp}.txt"
         report_filepath = f"data/group_scans/{report_filename}"
-        
-        with open(report_filepath, 'w', encoding='utf-8') as f:  # Added UTF-8 encoding
-            f.write("=" * 60 + "\n")
-            f.write("GROUP SCAN REPORT\n")
-            f.write("=" * 60 + "\n")
-            f.write(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write(f"Total Faces: {len(results)}\n")
-            f.write(f"Paid: {sum(1 for r in results if r['status'] == 'paid')}\n")
-            f.write(f"Unpaid/Unknown: {sum(1 for r in results if r['status'] == 'unpaid')}\n")
-            f.write("\n" + "=" * 60 + "\n")
-            f.write("INDIVIDUAL RESULTS:\n")
-            f.write("=" * 60 + "\n\n")
-            
-            for i, result in enumerate(results, 1):
-                status_text = "[PAID]" if result['status'] == 'paid' else "[UNPAID]"  # Changed from emojis
-                f.write(f"{i}. {status_text}\n")
-                f.write(f"   Name: {result['name']}\n")
-                if result['name'] != 'Unknown':
-                    f.write(f"   Student ID: {result['student_id']}\n")
-                    f.write(f"   Confidence: {result['confidence']:.1f}%\n")
-                f.write("\n")
+        report = []
+        
+        report.append("=" * 60 + "\n")
+        report.append("GROUP SCAN REPORT\n")
+        report.append("=" * 60 + "\n")
+        report.append(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        report.append(f"Total Faces: {len(results)}\n")
+        report.append(f"Paid: {sum(1 for r in results if r.status == 'paid')}\n")
+        report.append(f"Unpaid/Unknown: {sum(1 for r in results if r.status == 'unpaid')}\n")
+        report.append("\n" + "=" * 60 + "\n")
+        report.append("INDIVIDUAL RESULTS:\n")
+        report.append("=" * 60 + "\n\n")
+        
+        for i, result in enumerate(results, 1):
+            status_text = "[PAID]" if result.status == 'paid' else "[UNPAID]"  # Changed from emojis
+            report.append(f"{i}. {status_text}\n")
+            report.append(f"   Name: {result.name}\n")
+            if result.name != 'Unknown':
+                report.append(f"   Student ID: {result.student_id}\n")
+                report.append(f"   Confidence: {result.confidence:.1f}%\n")
+            report.append("\n")
+        
+        # The web dashboard pairs each .jpg with its .txt - queue the report first
+        ok, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, SCAN_JPEG_QUALITY,
+                                                   cv2.IMWRITE_JPEG_OPTIMIZE, 1])
+        self._io_queue.put((report_filepath, ''.join(report).encode('utf-8')))
+        if ok:
+            self._io_queue.put((filepath, encoded.tobytes()))
+        else:
+            print(f"❌ Could not encode {filename}")
         
         return filepath, report_filepath
     
+    def _io_worker(self):
+        """Background thread: write queued (path, bytes) files"""
+        while True:
+            path, data = self._io_queue.get()
+            try:
+                # Write beside the target and swap in, so readers never see half a file
+                tmp_path = path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                print(f"❌ Error saving {path}: {e}")
+            finally:
+                self._io_queue.task_done()
+    
     def start_scanner(self):
         """Start the live group scanner"""
         print("\n" + "=" * 60)
@@ -331,13 +604,21 @@ class LiveGroupScanner:
         print("   • Quick face detection")
         print("\n" + "=" * 60 + "\n")
         
-        self.cap = cv2.VideoCapture(0)
+        # Talk to V4L2 directly on Linux, fall back to OpenCV's default backend
+        self.cap = None
+        if sys.platform.startswith('linux'):
+            self.cap = cv2.VideoCapture(0, cv2.CAP_V4L2)
+        if self.cap is None or not self.cap.isOpened():
+            self.cap = cv2.VideoCapture(0)
         
         if not self.cap.isOpened():
             print("❌ Could not open webcam!")
             return
         
-        # Set camera properties
+        # Set camera properties - MJPEG frames are cheaper to move than raw
+        # YUYV, and a one-frame buffer means read() never returns a stale frame
+        self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
         self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
         self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
         # Reduce FPS for better performance
@@ -347,10 +628,13 @@ class LiveGroupScanner:
         print("\n📍 Position all people in frame")
         print("📸 Press SPACE when ready to scan\n")
         
-        # Variables for smooth display
-        last_faces = []  # Remember last detected faces to avoid flicker
-        detection_interval = 10  # Detect faces every 10 frames (was 5 - more stable now)
-        frame_count = 0
+        # Face detection runs on its own thread so the preview never waits on it
+        self._stop_detection.clear()
+        detector = threading.Thread(target=self._detect_worker, daemon=True)
+        detector.start()
+        
+        # Preview buffers, allocated once and reused for every frame
+        display_buf = None
         
         while True:
             ret, frame = self.cap.read()
@@ -358,14 +642,17 @@ class LiveGroupScanner:
                 print("❌ Failed to read frame")
                 break
             
-            frame_count += 1
-            
-            # Detect faces periodically (not every frame) to reduce flicker
-            if frame_count % detection_interval == 0:
-                last_faces = self.fr_system.detect_faces(frame)
+            # Hand the newest frame to the detector, show its latest boxes
+            with self._frame_lock:
+                self._latest_frame = frame
+            self._frame_ready.set()
+            last_faces = self._latest_faces
             
             # Create display frame
-            display_frame = frame.copy()
+            if display_buf is None or display_buf.shape != frame.shape:
+                display_buf = np.empty_like(frame)
+            np.copyto(display_buf, frame)
+            display_frame = display_buf
             
             # Always draw the last detected faces (smooth display)
             for (x, y, w, h) in last_faces:
@@ -383,8 +670,12 @@ class LiveGroupScanner:
             key = cv2.waitKey(15) & 0xFF
             
             if key == 32:  # SPACE - Scan all faces
-                # Get fresh detection
-                current_faces = self.fr_system.detect_faces(frame)
+                # One grayscale conversion serves the check, detection and hashing
+                gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                
+                # Get fresh detection - at the full scan scale, so small faces
+                # the quarter-resolution preview misses still get scanned
+                current_faces = self.detect_faces(frame, gray_frame=gray_frame)
                 
                 if len(current_faces) == 0:
                     print("⚠️  No faces detected! Position people in frame.")
@@ -402,7 +693,7 @@ class LiveGroupScanner:
                 
                 # Recognize all faces - NOW MUCH FASTER!
                 start_time = datetime.now()
-                results = self.recognize_all_faces(frame)
+                results = self.recognize_all_faces(frame, gray_frame, current_faces)
                 end_time = datetime.now()
                 
                 processing_time = (end_time - start_time).total_seconds()
@@ -424,15 +715,15 @@ class LiveGroupScanner:
                 print("📊 SCAN RESULTS")
                 print("=" * 60)
                 print(f"Total Faces: {len(results)}")
-                print(f"✅ Paid: {sum(1 for r in results if r['status'] == 'paid')}")
-                print(f"❌ Unpaid/Unknown: {sum(1 for r in results if r['status'] == 'unpaid')}")
+                print(f"✅ Paid: {sum(1 for r in results if r.status == 'paid')}")
+                print(f"❌ Unpaid/Unknown: {sum(1 for r in results if r.status == 'unpaid')}")
                 
                 print("\nIndividual Results:")
                 for i, result in enumerate(results, 1):
-                    status_icon = "✅" if result['status'] == 'paid' else "❌"
-                    print(f"{i}. {status_icon} {result['label']}: {result['name']}")
-                    if result['name'] != 'Unknown':
-                        print(f"   Confidence: {result['confidence']:.1f}%")
+                    status_icon = "✅" if result.status == 'paid' else "❌"
+                    print(f"{i}. {status_icon} {result.label}: {result.name}")
+                    if result.name != 'Unknown':
+                        print(f"   Confidence: {result.confidence:.1f}%")
                 
                 print("\n" + "=" * 60)
                 print(f"💾 Marked image saved: {image_path}")
@@ -452,11 +743,15 @@ class LiveGroupScanner:
             
             elif key == ord('c'):  # Clear cache
                 self.session_cache.clear()
+                self._last_scan_results = []
                 print("🗑️  Session cache cleared!")
         
         # Cleanup
+        self._stop_detection.set()
+        detector.join(timeout=1.0)
         self.cap.release()
         cv2.destroyAllWindows()
+        self._io_queue.join()  # Finish writing any saved scans
         
         print("\n✅ Scanner closed!")
 
@@ -0,0 +1,93 @@
+"""Two FaceRecognitionSystem instances (e.g. two pool workers) sharing one embeddings cache"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip('deepface')
+import face_recognition
+from face_recognition import FaceRecognitionSystem, l2_normalize
+
+
+@pytest.fixture
+def make_system(tmp_path, monkeypatch):
+    # No embedding model is needed to exercise the cache files
+    monkeypatch.setattr(FaceRecognitionSystem, 'load_face_analyzer', lambda self, name: None)
+    monkeypatch.setattr(FaceRecognitionSystem, 'load_onnx_session', lambda self: None)
+    return lambda: FaceRecognitionSystem(base_dir=tmp_path)
+
+
+def embedding(seed):
+    return l2_normalize(np.random.default_rng(seed).standard_normal(512).astype(np.float32))
+
+
+def add_student(system, student_id, seed):
+    system.forget_disk_row(student_id)
+    system.embeddings_cache[student_id] = {
+        'embedding': embedding(seed), 'model': system.embedding_model,
+        'name': student_id, 'department': '', 'image_path': ''
+    }
+    system.rebuild_matrix()
+    system.save_embeddings_cache()
+
+
+def assert_cache(system, expected):
+    assert sorted(system.embeddings_cache) == sorted(expected)
+    for student_id, seed in expected.items():
+        np.testing.assert_allclose(system.embeddings_cache[student_id]['embedding'], embedding(seed))
+
+
+def test_appends_from_both_instances_are_kept(make_system):
+    a, b = make_system(), make_system()
+    add_student(a, 's1', 1)
+    assert a.commit()
+    add_student(b, 's2', 2)
+    assert b.commit()
+
+    assert_cache(make_system(), {'s1': 1, 's2': 2})
+
+
+def test_tombstone_after_another_instance_compacted(make_system):
+    writer = make_system()
+    for i, student_id in enumerate(['s1', 's2', 's3']):
+        add_student(writer, student_id, i)
+    assert writer.commit()
+
+    a, b = make_system(), make_system()
+    # a compacts the files: s3 moves from row 2 to row 1
+    assert a.delete_student('s1')
+    a._rewrite = True
+    assert a.commit()
+    # b's tombstone for s2 is row 1 of the files it read - now s3's row
+    assert b.delete_student('s2')
+    add_student(b, 's4', 4)
+    assert b.commit()
+
+    expected = {'s3': 2, 's4': 4}
+    assert_cache(b, expected)
+    assert_cache(make_system(), expected)
+
+
+def test_reregistration_replaces_the_other_instances_row(make_system):
+    a = make_system()
+    add_student(a, 's1', 1)
+    assert a.commit()
+
+    b, c = make_system(), make_system()
+    add_student(b, 's1', 10)
+    assert b.commit()
+    add_student(c, 's2', 2)
+    assert c.commit()
+
+    assert_cache(make_system(), {'s1': 10, 's2': 2})
+
+
+def test_unchanged_files_are_appended_to(make_system, monkeypatch):
+    a = make_system()
+    add_student(a, 's1', 1)
+    assert a.commit()
+    monkeypatch.setattr(face_recognition.FaceRecognitionSystem, 'write_all_to_disk',
+                        lambda self: pytest.fail("rewrote files nobody else changed"))
+    add_student(a, 's2', 2)
+    assert a.commit()
+
+    assert_cache(make_system(), {'s1': 1, 's2': 2})